@@ -0,0 +1,187 @@
+import os
+import time
+import random
+import bisect
+import hashlib
+from datetime import datetime
+from config import VIDEO_DIR, CHANNELS, CHANNEL_REFRESH_MINUTES
+from db import get_db
+from video import get_all_videos, get_show_name, rel_video_path, library_version
+
+# Расписания в памяти: имя канала -> dict(signature, epoch, total, starts, entries)
+_schedules = {}
+# Когда каталог канала последний раз сверялся: имя канала -> (версия библиотеки, time.monotonic())
+_verified = {}
+
+
+def get_channel_catalog(name):
+    """Возвращает {rel_path: duration} для файлов канала с известной длительностью."""
+    shows = CHANNELS[name]
+    available = {rel_video_path(f) for f in get_all_videos()}
+    conn = get_db()
+    rows = conn.execute('SELECT file_path, duration FROM video_checks WHERE ok = 1 AND duration > 0').fetchall()
+    conn.close()
+    catalog = {}
+    for row in rows:
+        path = row["file_path"]
+        if path not in available:
+            continue
+        if shows and get_show_name(os.path.join(VIDEO_DIR, path)) not in shows:
+            continue
+        catalog[path] = row["duration"]
+    return catalog
+
+
+def catalog_signature(catalog):
+    digest = hashlib.sha1()
+    for path in sorted(catalog):
+        digest.update(f"{path}\0{catalog[path]}\n".encode())
+    return digest.hexdigest()
+
+
+def interleave_by_show(paths, seed):
+    """Перемешивает серии внутри сериалов и чередует сериалы по кругу, как в эфире."""
+    rng = random.Random(seed)
+    by_show = {}
+    for path in sorted(paths):
+        by_show.setdefault(get_show_name(os.path.join(VIDEO_DIR, path)), []).append(path)
+    queues = []
+    for show in sorted(by_show):
+        episodes = by_show[show]
+        rng.shuffle(episodes)
+        queues.append(episodes)
+    playlist = []
+    while queues:
+        for episodes in queues:
+            playlist.append(episodes.pop())
+        queues = [q for q in queues if q]
+    return playlist
+
+
+def _locate(schedule, now):
+    """Бинарный поиск по накопленным стартам: (индекс записи, смещение внутри неё)."""
+    position = (now - schedule["epoch"]) % schedule["total"]
+    index = bisect.bisect_right(schedule["starts"], position) - 1
+    return index, position - schedule["starts"][index]
+
+
+def _build(entries_paths, catalog, epoch, signature):
+    starts = []
+    entries = []
+    elapsed = 0.0
+    for path in entries_paths:
+        starts.append(elapsed)
+        entries.append((path, catalog[path]))
+        elapsed += catalog[path]
+    return {"signature": signature, "epoch": epoch, "total": elapsed, "starts": starts, "entries": entries}
+
+
+def regenerate_schedule(name, catalog, signature, previous=None, now=None):
+    """Обновляет расписание инкрементально: удалённые файлы выпадают, новые
+    дописываются в конец, а эфир продолжается с того же места."""
+    now = now or time.time()
+    if not previous or not previous["total"]:
+        return _build(interleave_by_show(catalog, f"{name}:{signature}"), catalog, now, signature)
+
+    old_paths = [path for path, _ in previous["entries"]]
+    kept = [path for path in old_paths if path in catalog]
+    known = set(kept)
+    added = interleave_by_show([p for p in catalog if p not in known], f"{name}:{signature}")
+    schedule = _build(kept + added, catalog, now, signature)
+    if not schedule["total"]:
+        return schedule
+
+    # Переякорим эфир: текущая серия (или следующая уцелевшая) не должна сдвинуться
+    index, offset = _locate(previous, now)
+    positions = {path: i for i, path in enumerate(kept + added)}
+    for step in range(len(old_paths)):
+        path = old_paths[(index + step) % len(old_paths)]
+        if path in positions:
+            if step:
+                offset = 0.0
+            schedule["epoch"] = now - (schedule["starts"][positions[path]] + offset)
+            break
+    return schedule
+
+
+def _load_schedule(conn, name):
+    channel = conn.execute('SELECT epoch, total_duration, signature FROM channels WHERE name = ?', (name,)).fetchone()
+    if not channel:
+        return None
+    rows = conn.execute(
+        'SELECT file_path, start, duration FROM channel_schedule WHERE channel = ? ORDER BY position',
+        (name,)
+    ).fetchall()
+    return {
+        "signature": channel["signature"],
+        "epoch": channel["epoch"],
+        "total": channel["total_duration"],
+        "starts": [row["start"] for row in rows],
+        "entries": [(row["file_path"], row["duration"]) for row in rows],
+    }
+
+
+def _save_schedule(conn, name, schedule):
+    conn.execute('DELETE FROM channel_schedule WHERE channel = ?', (name,))
+    conn.execute(
+        'INSERT OR REPLACE INTO channels (name, epoch, total_duration, signature, updated_at) VALUES (?, ?, ?, ?, ?)',
+        (name, schedule["epoch"], schedule["total"], schedule["signature"], datetime.now())
+    )
+    conn.executemany(
+        'INSERT INTO channel_schedule (channel, position, file_path, start, duration) VALUES (?, ?, ?, ?, ?)',
+        [
+            (name, i, path, start, duration)
+            for i, ((path, duration), start) in enumerate(zip(schedule["entries"], schedule["starts"]))
+        ]
+    )
+    conn.commit()
+
+
+def ensure_schedule(name):
+    """Возвращает актуальное расписание канала, перестраивая его при изменении библиотеки.
+    Обход библиотеки — только после изменений или по истечении CHANNEL_REFRESH_MINUTES,
+    в остальное время настройка на канал сводится к бинарному поиску."""
+    version = library_version()
+    cached = _schedules.get(name)
+    verified = _verified.get(name)
+    fresh = verified and verified[0] == version and time.monotonic() - verified[1] < CHANNEL_REFRESH_MINUTES * 60
+    if cached and fresh:
+        return cached
+
+    catalog = get_channel_catalog(name)
+    signature = catalog_signature(catalog)
+    _verified[name] = (version, time.monotonic())
+    if cached and cached["signature"] == signature:
+        return cached
+
+    conn = get_db()
+    stored = cached or _load_schedule(conn, name)
+    if stored and stored["signature"] == signature:
+        schedule = stored
+    else:
+        schedule = regenerate_schedule(name, catalog, signature, stored)
+        _save_schedule(conn, name, schedule)
+        print(f"[CHANNEL] {name}: schedule rebuilt, {len(schedule['entries'])} episodes, "
+              f"{round(schedule['total'] / 3600, 1)}h cycle", flush=True)
+    conn.close()
+    _schedules[name] = schedule
+    return schedule
+
+
+def up_next(name, now=None):
+    """Следующая серия в эфире канала (для прогрева кэша) или None."""
+    schedule = ensure_schedule(name)
+    if not schedule["total"]:
+        return None
+    index, _ = _locate(schedule, now or time.time())
+    return schedule["entries"][(index + 1) % len(schedule["entries"])][0]
+
+
+def whats_on(name, now=None):
+    """Что идёт на канале сейчас: (rel_path, смещение в секундах, длительность) или None."""
+    schedule = ensure_schedule(name)
+    if not schedule["total"]:
+        return None
+    index, offset = _locate(schedule, now or time.time())
+    path, duration = schedule["entries"][index]
+    return path, offset, duration
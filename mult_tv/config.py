@@ -1,10 +1,61 @@
 import os
 
-VIDEO_DIR = "/downloads"
+# Корни библиотеки через ":" — можно добавлять диски. Первый корень основной:
+# туда качает transmission. Пути файлов хранятся относительно своего корня,
+# одинаковые папки сериалов на разных дисках сливаются в один сериал.
+VIDEO_DIRS = [d for d in os.environ.get("VIDEO_DIRS", "/downloads").split(":") if d]
+VIDEO_DIR = VIDEO_DIRS[0]
 DB_PATH = "/app/data/history.db"
 STATIC_DIR = "/app/static"
 SESSION_MAX_AGE_DAYS = 30
-COMPLETE_DIR = os.path.join(VIDEO_DIR, "complete")
 TRANSMISSION_URL = "http://transmission:9091"
 TRANSMISSION_USER = os.environ.get("TRANSMISSION_USER", "admin")
 TRANSMISSION_PASS = os.environ.get("TRANSMISSION_PASS", "")
+HISTORY_RETENTION_DAYS = int(os.environ.get("HISTORY_RETENTION_DAYS", "180"))
+HISTORY_COMPACT_INTERVAL_HOURS = 24
+# Линейные каналы: имя -> список сериалов (пустой список = все сериалы)
+CHANNELS = {"mult": []}
+# Каталог каналов перечитывается при изменении библиотеки или не реже чем раз в N минут
+CHANNEL_REFRESH_MINUTES = 10
+# Раздача видео: общий аплинк делится между зрителями
+UPLINK_BYTES_PER_SEC = int(float(os.environ.get("UPLINK_MBIT", "50")) * 125000)
+STREAM_MAX_PER_USER = int(os.environ.get("STREAM_MAX_PER_USER", "2"))
+STREAM_RATE_HEADROOM = 1.25  # запас над битрейтом файла
+STREAM_BURST_SECONDS = 8  # сколько секунд видео можно отдать залпом при старте/перемотке
+STREAM_DEFAULT_BITRATE = 4 * 125000  # если битрейт файла неизвестен (4 Мбит/с)
+STREAM_CHUNK_SIZE = 64 * 1024
+STREAM_IDLE_TIMEOUT = 30
+# Сверх лимита пользователя вытесняется только раздача, которая не отдавала данных столько секунд
+STREAM_EVICT_IDLE_SECONDS = 5
+# Управление местом: при заполнении диска выше HIGH_WATER освобождаем до LOW_WATER
+STORAGE_HIGH_WATER = float(os.environ.get("STORAGE_HIGH_WATER", "0.90"))
+STORAGE_LOW_WATER = float(os.environ.get("STORAGE_LOW_WATER", "0.80"))
+STORAGE_AUTO_EVICT = os.environ.get("STORAGE_AUTO_EVICT", "0") == "1"
+STORAGE_PROTECT_DAYS = 14  # недавно скачанное или просмотренное не удаляем
+STORAGE_CHECK_INTERVAL_MINUTES = 30
+# Кэш начала серий в памяти: moov и первые секунды без холодного seek по HDD
+HOT_CACHE_HEAD_MB = 4
+HOT_CACHE_MAX_MB = int(os.environ.get("HOT_CACHE_MAX_MB", "256"))
+HOT_CACHE_PREFETCH_PER_SHOW = 3
+# Фоновая перепаковка MP4 с moov в конце (-c copy -movflags +faststart)
+FASTSTART_REMUX = os.environ.get("FASTSTART_REMUX", "1") == "1"
+FASTSTART_REMUX_INTERVAL_MINUTES = 60
+# Живой ремукс файлов с неподдерживаемыми кодеками (видео копируется, аудио -> AAC)
+LIVE_TRANSCODE_MAX = int(os.environ.get("LIVE_TRANSCODE_MAX", "2"))
+LIVE_TRANSCODE_KEEP = os.environ.get("LIVE_TRANSCODE_KEEP", "0") == "1"
+# Предпочитаемая аудиодорожка: регулярка по тегам language/title, как LANG_FILTER в convert.sh
+AUDIO_LANG_FILTER = os.environ.get("AUDIO_LANG_FILTER", "eng|english|orig")
+# Глубокая проверка: декодирование коротких окон в нескольких точках файла
+DEEP_CHECK_SAMPLES = 6
+DEEP_CHECK_WINDOW_SECONDS = 3
+# Сколько сообщений декодера на окно не считается поломкой: после -ss в open-GOP
+# H.264/HEVC первые кадры до следующего ключевого ругаются на недостающие ссылки
+DEEP_CHECK_TOLERATED_ERRORS = 8
+DEEP_CHECK_WORKERS = int(os.environ.get("DEEP_CHECK_WORKERS", str(max(1, (os.cpu_count() or 2) // 2))))
+# Поиск заставок: огибающая звука первых минут серий, сравнение внутри сериала
+INTRO_SCAN_SECONDS = 300
+INTRO_MIN_SECONDS = 15
+INTRO_MAX_SECONDS = 120
+INTRO_MIN_EPISODES = 3
+INTRO_WORKERS = int(os.environ.get("INTRO_WORKERS", "2"))
+INTRO_ANALYSIS_INTERVAL_MINUTES = 60
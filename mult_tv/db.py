@@ -1,7 +1,8 @@
 import os
 import sqlite3
 import secrets
-from config import DB_PATH
+from datetime import datetime, timedelta
+from config import DB_PATH, HISTORY_RETENTION_DAYS
 from auth import hash_password
 
 
@@ -11,11 +12,8 @@ def get_db():
     return conn
 
 
-def init_db():
-    os.makedirs(os.path.dirname(DB_PATH), exist_ok=True)
-    conn = get_db()
-    cursor = conn.cursor()
-
+def _migration_1_base_schema(cursor):
+    """Базовая схема (таблицы, существовавшие до введения миграций)."""
     cursor.execute('''
         CREATE TABLE IF NOT EXISTS history (
             id INTEGER PRIMARY KEY AUTOINCREMENT,
@@ -66,6 +64,147 @@ def init_db():
         )
     ''')
 
+
+def _migration_2_indexes(cursor):
+    """Индексы под горячие запросы: история, сессии, проверки, отчёты."""
+    # get_random_video: WHERE watched_at > ?; retention-очистка
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_history_watched_at ON history (watched_at)')
+    # mark_watched: WHERE file_path = ? AND watched_at > ?
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_history_file_watched ON history (file_path, watched_at)')
+    # login: DELETE FROM sessions WHERE created_at < ?
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_sessions_created_at ON sessions (created_at)')
+    # get_blocked_files: WHERE ok = 0
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_video_checks_ok ON video_checks (ok)')
+    # list_reports: ORDER BY created_at DESC
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_reports_created_at ON reports (created_at)')
+
+
+def _migration_3_channels(cursor):
+    """Таблицы линейных каналов: якорь эфира и расписание с накопленным временем."""
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS channels (
+            name TEXT PRIMARY KEY,
+            epoch REAL NOT NULL,
+            total_duration REAL NOT NULL DEFAULT 0,
+            signature TEXT DEFAULT '',
+            updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+    ''')
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS channel_schedule (
+            channel TEXT NOT NULL REFERENCES channels(name) ON DELETE CASCADE,
+            position INTEGER NOT NULL,
+            file_path TEXT NOT NULL,
+            start REAL NOT NULL,
+            duration REAL NOT NULL,
+            PRIMARY KEY (channel, position)
+        )
+    ''')
+
+
+def _migration_4_video_layout(cursor):
+    """Отпечаток файла и расположение moov в video_checks."""
+    cursor.execute("ALTER TABLE video_checks ADD COLUMN fingerprint TEXT DEFAULT ''")
+    # 1 — moov в начале, 0 — в конце, -1 — перепаковка не удалась, NULL — неизвестно
+    cursor.execute('ALTER TABLE video_checks ADD COLUMN faststart INTEGER')
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_video_checks_faststart ON video_checks (faststart)')
+
+
+def _migration_5_deep_checks(cursor):
+    """Результаты глубокой проверки декодированием. Действительны, пока
+    deep_fingerprint совпадает с fingerprint файла."""
+    cursor.execute('ALTER TABLE video_checks ADD COLUMN deep_ok INTEGER')
+    cursor.execute("ALTER TABLE video_checks ADD COLUMN deep_errors TEXT DEFAULT ''")
+    cursor.execute("ALTER TABLE video_checks ADD COLUMN deep_fingerprint TEXT DEFAULT ''")
+    cursor.execute('ALTER TABLE video_checks ADD COLUMN deep_checked_at TIMESTAMP')
+
+
+def _migration_6_file_hashes(cursor):
+    """Кэш хешей содержимого для поиска дублей, по отпечатку файла."""
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS file_hashes (
+            file_path TEXT PRIMARY KEY,
+            fingerprint TEXT NOT NULL,
+            size INTEGER NOT NULL,
+            partial_hash TEXT NOT NULL,
+            full_hash TEXT DEFAULT '',
+            hashed_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+    ''')
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_file_hashes_partial ON file_hashes (size, partial_hash)')
+
+
+def _migration_7_intros(cursor):
+    """Заставки: шаблон огибающей на сериал и найденные смещения на файл."""
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS show_intros (
+            show TEXT PRIMARY KEY,
+            template BLOB NOT NULL,
+            duration REAL NOT NULL,
+            updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+    ''')
+    # intro_end IS NULL — файл проанализирован, заставка не найдена
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS intro_offsets (
+            file_path TEXT PRIMARY KEY,
+            fingerprint TEXT NOT NULL,
+            intro_start REAL,
+            intro_end REAL,
+            score REAL DEFAULT 0,
+            analyzed_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+    ''')
+
+
+
+def _migration_8_reset_deep_failures(cursor):
+    """Старое правило глубокой проверки браковало файлы за шум декодера после перемотки.
+    Сбрасываем отрицательные вердикты: файлы снова видны и перепроверятся."""
+    cursor.execute('UPDATE video_checks SET deep_fingerprint = NULL WHERE deep_ok = 0')
+
+
+# Миграции применяются по порядку, номер версии = позиция в списке.
+# Новые миграции добавляются только в конец, существующие не меняются.
+MIGRATIONS = [
+    _migration_1_base_schema,
+    _migration_2_indexes,
+    _migration_3_channels,
+    _migration_4_video_layout,
+    _migration_5_deep_checks,
+    _migration_6_file_hashes,
+    _migration_7_intros,
+    _migration_8_reset_deep_failures,
+]
+SCHEMA_VERSION = len(MIGRATIONS)
+
+
+def migrate(conn):
+    """Применяет недостающие миграции по PRAGMA user_version.
+    Каждая миграция выполняется в отдельной транзакции."""
+    version = conn.execute('PRAGMA user_version').fetchone()[0]
+    if version >= SCHEMA_VERSION:
+        return version
+    for number in range(version + 1, SCHEMA_VERSION + 1):
+        cursor = conn.cursor()
+        cursor.execute('BEGIN')
+        try:
+            MIGRATIONS[number - 1](cursor)
+            cursor.execute(f'PRAGMA user_version = {number}')
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
+        print(f"[MIGRATE] Schema upgraded to v{number}: {MIGRATIONS[number - 1].__name__}", flush=True)
+    return SCHEMA_VERSION
+
+
+def init_db():
+    os.makedirs(os.path.dirname(DB_PATH), exist_ok=True)
+    conn = get_db()
+    migrate(conn)
+    cursor = conn.cursor()
+
     # Создаём дефолтного админа если нет ни одного пользователя
     cursor.execute('SELECT COUNT(*) FROM users')
     if cursor.fetchone()[0] == 0:
@@ -79,3 +218,19 @@ def init_db():
 
     conn.commit()
     conn.close()
+
+
+def compact_history():
+    """Удаляет записи истории старше HISTORY_RETENTION_DAYS и схлопывает
+    повторные просмотры одного файла за один день. Возвращает число удалённых строк."""
+    conn = get_db()
+    cutoff = datetime.now() - timedelta(days=HISTORY_RETENTION_DAYS)
+    expired = conn.execute('DELETE FROM history WHERE watched_at < ?', (cutoff,)).rowcount
+    duplicates = conn.execute('''
+        DELETE FROM history WHERE id NOT IN (
+            SELECT MIN(id) FROM history GROUP BY file_path, date(watched_at)
+        )
+    ''').rowcount
+    conn.commit()
+    conn.close()
+    return expired + duplicates
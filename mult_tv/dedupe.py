@@ -0,0 +1,150 @@
+import os
+import hashlib
+from datetime import datetime
+from config import VIDEO_DIR
+from db import get_db
+from video import scan_videos, get_show_name, file_fingerprint, resolve_video_path
+from storage import get_watch_stats, purge_files
+
+SAMPLE_BYTES = 64 * 1024
+FULL_HASH_CHUNK = 1024 * 1024
+
+
+def partial_hash(full_path, size):
+    """Дешёвый хеш: размер + блоки из начала, середины и конца файла."""
+    digest = hashlib.blake2b(str(size).encode(), digest_size=16)
+    with open(full_path, "rb") as f:
+        for offset in (0, max(size // 2 - SAMPLE_BYTES // 2, 0), max(size - SAMPLE_BYTES, 0)):
+            f.seek(offset)
+            digest.update(f.read(SAMPLE_BYTES))
+    return digest.hexdigest()
+
+
+def full_hash(full_path):
+    digest = hashlib.blake2b(digest_size=32)
+    with open(full_path, "rb") as f:
+        while chunk := f.read(FULL_HASH_CHUNK):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def refresh_hashes():
+    """Обновляет file_hashes: частичный хеш для новых/изменённых файлов,
+    полный — только для кандидатов с совпавшими (size, partial_hash).
+    Возвращает {rel_path: строка file_hashes} для текущей библиотеки."""
+    files = scan_videos()
+    conn = get_db()
+    cached = {row["file_path"]: dict(row) for row in conn.execute('SELECT * FROM file_hashes').fetchall()}
+
+    gone = [(p,) for p in cached if p not in files]
+    conn.executemany('DELETE FROM file_hashes WHERE file_path = ?', gone)
+
+    rows = {}
+    for rel_path, full_path in files.items():
+        try:
+            fingerprint = file_fingerprint(full_path)
+            row = cached.get(rel_path)
+            if not row or row["fingerprint"] != fingerprint:
+                size = os.path.getsize(full_path)
+                row = {
+                    "file_path": rel_path, "fingerprint": fingerprint, "size": size,
+                    "partial_hash": partial_hash(full_path, size), "full_hash": "",
+                }
+                conn.execute(
+                    'INSERT OR REPLACE INTO file_hashes (file_path, fingerprint, size, partial_hash, full_hash, hashed_at) '
+                    'VALUES (?, ?, ?, ?, ?, ?)',
+                    (rel_path, fingerprint, size, row["partial_hash"], "", datetime.now())
+                )
+        except OSError:
+            continue
+        rows[rel_path] = row
+
+    candidates = {}
+    for row in rows.values():
+        candidates.setdefault((row["size"], row["partial_hash"]), []).append(row)
+    for group in candidates.values():
+        if len(group) < 2:
+            continue
+        for row in group:
+            if row["full_hash"]:
+                continue
+            try:
+                row["full_hash"] = full_hash(files[row["file_path"]])
+            except OSError:
+                continue
+            conn.execute(
+                'UPDATE file_hashes SET full_hash = ? WHERE file_path = ?',
+                (row["full_hash"], row["file_path"])
+            )
+
+    conn.commit()
+    conn.close()
+    return rows
+
+
+def find_duplicates():
+    """Группы файлов с одинаковым содержимым. В каждой группе оставляем
+    самый просматриваемый файл (при равенстве — первый по пути)."""
+    rows = refresh_hashes()
+    watch_stats = get_watch_stats()
+    by_hash = {}
+    for row in rows.values():
+        if row["full_hash"]:
+            by_hash.setdefault(row["full_hash"], []).append(row)
+
+    groups = []
+    for digest, group in by_hash.items():
+        if len(group) < 2:
+            continue
+        files = sorted(
+            (
+                {
+                    "path": row["file_path"],
+                    "show": get_show_name(os.path.join(VIDEO_DIR, row["file_path"])),
+                    "size_mb": round(row["size"] / (1024 * 1024), 1),
+                    "views": watch_stats.get(row["file_path"], (None, 0))[1],
+                }
+                for row in group
+            ),
+            key=lambda f: (-f["views"], f["path"])
+        )
+        groups.append({
+            "hash": digest,
+            "keep": files[0]["path"],
+            "files": files,
+            "wasted_mb": round(sum(f["size_mb"] for f in files[1:]), 1),
+        })
+    groups.sort(key=lambda g: g["wasted_mb"], reverse=True)
+    return {"groups": groups, "wasted_mb": round(sum(g["wasted_mb"] for g in groups), 1)}
+
+
+def _hashed_unchanged(row):
+    """Файл не менялся с момента полного хеширования."""
+    if not row or not row["full_hash"]:
+        return False
+    try:
+        return file_fingerprint(resolve_video_path(row["file_path"])) == row["fingerprint"]
+    except OSError:
+        return False
+
+
+def reclaim_duplicates(pairs):
+    """Удаляет копии из просмотренных админом пар (keep, remove), перенося их историю
+    просмотров на оставляемый файл. Пара пропускается, если файлы больше не совпадают
+    или изменились после хеширования, а также если keep сам удаляется в другой паре."""
+    conn = get_db()
+    hashes = {row["file_path"]: row for row in conn.execute('SELECT * FROM file_hashes').fetchall()}
+    conn.close()
+    removing = {remove for _, remove in pairs}
+    move_history = {}
+    for keep, remove in pairs:
+        if keep == remove or keep in removing:
+            continue
+        keep_row, remove_row = hashes.get(keep), hashes.get(remove)
+        if not (_hashed_unchanged(keep_row) and _hashed_unchanged(remove_row)):
+            continue
+        if keep_row["full_hash"] == remove_row["full_hash"]:
+            move_history[remove] = keep
+    result = purge_files(list(move_history), move_history)
+    result["skipped"] = sorted(removing - set(result["removed"]))
+    return result
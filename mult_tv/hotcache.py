@@ -0,0 +1,148 @@
+import asyncio
+import random
+import threading
+from collections import OrderedDict
+from config import HOT_CACHE_HEAD_MB, HOT_CACHE_MAX_MB, HOT_CACHE_PREFETCH_PER_SHOW
+from video import (
+    rel_video_path, resolve_video_path, get_next_show, get_show_candidates, file_fingerprint
+)
+
+HEAD_BYTES = HOT_CACHE_HEAD_MB * 1024 * 1024
+MAX_BYTES = HOT_CACHE_MAX_MB * 1024 * 1024
+
+_heads = OrderedDict()  # rel_path -> (fingerprint, bytes), порядок = LRU
+_size = 0
+# invalidate зовут из потоков (purge_files, перепаковка), остальное — из цикла событий
+_lock = threading.Lock()
+_queue = None
+stats = {"hits": 0, "misses": 0, "bytes_served": 0, "prefetched": 0}
+
+
+def cached_paths():
+    with _lock:
+        return set(_heads)
+
+
+def _evict(rel_path):
+    """Только под _lock."""
+    global _size
+    entry = _heads.pop(rel_path, None)
+    if entry:
+        _size -= len(entry[1])
+
+
+def get_head(rel_path, full_path):
+    """Закэшированное начало файла или None. Устаревшие записи выбрасываются."""
+    with _lock:
+        entry = _heads.get(rel_path)
+    if not entry:
+        return None
+    try:
+        fingerprint = file_fingerprint(full_path)
+    except OSError:
+        fingerprint = None
+    with _lock:
+        # Пока шёл stat, запись могли выбросить или заменить
+        if _heads.get(rel_path) is not entry:
+            return None
+        if fingerprint != entry[0]:
+            _evict(rel_path)
+            return None
+        _heads.move_to_end(rel_path)
+    return entry[1]
+
+
+def invalidate(rel_path):
+    with _lock:
+        _evict(rel_path)
+
+
+def record_request(start, head):
+    """Учитывает запрос для hit rate: считаются только запросы к началу файла."""
+    if start >= HEAD_BYTES:
+        return
+    if head is not None and start < len(head):
+        stats["hits"] += 1
+    else:
+        stats["misses"] += 1
+
+
+def _read_head(full_path):
+    fingerprint = file_fingerprint(full_path)
+    with open(full_path, "rb") as f:
+        return fingerprint, f.read(HEAD_BYTES)
+
+
+async def _load(rel_path):
+    global _size
+    with _lock:
+        if rel_path in _heads:
+            _heads.move_to_end(rel_path)
+            return
+    full_path = resolve_video_path(rel_path)
+    try:
+        fingerprint, head = await asyncio.to_thread(_read_head, full_path)
+    except OSError:
+        return
+    with _lock:
+        _evict(rel_path)
+        _heads[rel_path] = (fingerprint, head)
+        _size += len(head)
+        while _size > MAX_BYTES and _heads:
+            _evict(next(iter(_heads)))
+    stats["prefetched"] += 1
+
+
+def schedule_prefetch(rel_paths):
+    """Ставит файлы в очередь прогрева. Если очередь переполнена — лишнее отбрасывается."""
+    if _queue is None:
+        return
+    for rel_path in rel_paths:
+        if rel_path in _heads:
+            continue
+        try:
+            _queue.put_nowait(rel_path)
+        except asyncio.QueueFull:
+            break
+
+
+def prefetch_next(current_show, by_show, recently_watched, shows=None, exclude=()):
+    """Повторяет логику get_random_video: после серии идёт серия того же сериала
+    (автопродолжение) или следующего по кругу (кнопка СЛЕД) — прогреваем их.
+    by_show — группировка из group_by_show, exclude — файлы, которые не греем (/live)."""
+    targets = []
+    for show in (current_show, get_next_show(current_show, shows)):
+        if show is None:
+            continue
+        candidates = [
+            p for p in map(rel_video_path, get_show_candidates(by_show.get(show, []), recently_watched))
+            if p not in exclude
+        ]
+        hot = [p for p in candidates if p in _heads]
+        cold = [p for p in candidates if p not in _heads]
+        need = max(HOT_CACHE_PREFETCH_PER_SHOW - len(hot), 0)
+        targets.extend(random.sample(cold, min(need, len(cold))))
+    schedule_prefetch(targets)
+
+
+async def prefetch_worker():
+    """Фоновый прогрев: читает головы файлов по одной, чтобы не мешать раздаче."""
+    global _queue
+    _queue = asyncio.Queue(maxsize=64)
+    while True:
+        rel_path = await _queue.get()
+        try:
+            await _load(rel_path)
+        except Exception as e:
+            print(f"[HOTCACHE] Prefetch failed for {rel_path}: {e}", flush=True)
+
+
+def get_cache_stats():
+    requests = stats["hits"] + stats["misses"]
+    return {
+        **stats,
+        "hit_rate": round(stats["hits"] / requests, 3) if requests else None,
+        "entries": len(_heads),
+        "size_mb": round(_size / (1024 * 1024), 1),
+        "max_mb": HOT_CACHE_MAX_MB,
+    }
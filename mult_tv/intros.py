@@ -0,0 +1,266 @@
+import random
+import subprocess
+import multiprocessing
+from datetime import datetime
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, as_completed
+import numpy as np
+from config import (
+    INTRO_SCAN_SECONDS, INTRO_MIN_SECONDS, INTRO_MAX_SECONDS, INTRO_MIN_EPISODES, INTRO_WORKERS
+)
+from db import get_db
+from video import get_all_videos, get_show_name, rel_video_path, resolve_video_path, file_fingerprint
+
+SAMPLE_RATE = 8000
+ENVELOPE_HZ = 10  # точек огибающей в секунду
+FRAME = SAMPLE_RATE // ENVELOPE_HZ
+SCAN_FRAMES = INTRO_SCAN_SECONDS * ENVELOPE_HZ
+LOCAL_WINDOW = 5 * ENVELOPE_HZ  # окно локальной корреляции при поиске шаблона
+LOCAL_THRESHOLD = 0.6  # корреляция окна, при которой эпизоды считаются совпавшими
+SUPPORT_THRESHOLD = 0.5  # доля эпизодов, в которых фрагмент должен повторяться
+MATCH_THRESHOLD = 0.5  # нормированная корреляция шаблона с эпизодом
+EXTRACT_THREADS = 2  # одновременных ffmpeg на процесс пула
+DETECT_EXTRA_EPISODES = 8  # сколько уже разобранных серий добавлять к поиску шаблона
+EPS = 1e-6
+
+
+def extract_envelope(full_path):
+    """Огибающая звука первых INTRO_SCAN_SECONDS секунд: приращения лог-энергии
+    с частотой ENVELOPE_HZ. Не зависит от громкости дорожки. None при ошибке.
+    ffmpeg с минимальным приоритетом CPU и диска, чтобы не мешать раздаче."""
+    try:
+        proc = subprocess.run(
+            [
+                "nice", "-n", "19", "ionice", "-c", "3",
+                "ffmpeg", "-nostdin", "-v", "error", "-t", str(INTRO_SCAN_SECONDS), "-i", full_path,
+                "-vn", "-ac", "1", "-ar", str(SAMPLE_RATE), "-f", "s16le", "pipe:1"
+            ],
+            capture_output=True, timeout=300
+        )
+    except (subprocess.TimeoutExpired, FileNotFoundError):
+        return None
+    if proc.returncode != 0:
+        return None
+    samples = np.frombuffer(proc.stdout, dtype=np.int16)
+    frames = len(samples) // FRAME
+    if frames < INTRO_MIN_SECONDS * ENVELOPE_HZ:
+        return None
+    x = samples[:frames * FRAME].astype(np.float32).reshape(frames, FRAME)
+    energy = np.log10(np.sqrt((x * x).mean(axis=1)) + 1.0)
+    return np.diff(energy, prepend=energy[0]).astype(np.float32)
+
+
+def _stack(envelopes):
+    """Нормирует огибающие и складывает в матрицу (n, SCAN_FRAMES) с нулевым хвостом."""
+    batch = np.zeros((len(envelopes), SCAN_FRAMES), dtype=np.float32)
+    for i, env in enumerate(envelopes):
+        env = env[:SCAN_FRAMES]
+        batch[i, :len(env)] = (env - env.mean()) / (env.std() + EPS)
+    return batch
+
+
+def _window_sums(x, width):
+    """Суммы по скользящему окну вдоль последней оси."""
+    cs = np.cumsum(x, axis=-1, dtype=np.float64)
+    cs = np.concatenate([np.zeros(cs.shape[:-1] + (1,)), cs], axis=-1)
+    return cs[..., width:] - cs[..., :-width]
+
+
+def _longest_run(mask):
+    """(start, end) самой длинной серии True, end не включительно."""
+    edges = np.diff(np.concatenate(([0], mask.astype(np.int8), [0])))
+    starts = np.flatnonzero(edges == 1)
+    ends = np.flatnonzero(edges == -1)
+    if not len(starts):
+        return 0, 0
+    best = int(np.argmax(ends - starts))
+    return int(starts[best]), int(ends[best])
+
+
+def match_template(batch, template):
+    """Нормированная взаимная корреляция шаблона со всеми эпизодами сразу (через FFT).
+    Возвращает (позиции начала, оценки) по эпизодам."""
+    width = len(template)
+    length = batch.shape[1]
+    t = (template - template.mean()) / (template.std() + EPS)
+    n_fft = 1 << int(np.ceil(np.log2(length + width)))
+    corr = np.fft.irfft(np.fft.rfft(batch, n_fft) * np.conj(np.fft.rfft(t, n_fft)), n_fft)
+    corr = corr[:, :length - width + 1]
+    s1 = _window_sums(batch, width)
+    s2 = _window_sums(batch * batch, width)
+    std = np.sqrt(np.maximum(s2 / width - (s1 / width) ** 2, 0))
+    ncc = corr / (width * std + EPS)
+    ncc[std < 1e-3] = 0  # тишина и нулевой хвост коротких серий
+    positions = ncc.argmax(axis=1)
+    return positions, ncc[np.arange(len(batch)), positions]
+
+
+def detect_template(batch):
+    """Ищет фрагмент, повторяющийся в большинстве эпизодов. Для каждого кандидата
+    в опорные эпизоды выравнивает остальные по максимуму взаимной корреляции и
+    считает локальную корреляцию окнами. Возвращает шаблон или None."""
+    count, length = batch.shape
+    n_fft = 2 * length
+    spectra = np.fft.rfft(batch, n_fft)
+    best = None
+    for ref in range(min(count, INTRO_MIN_EPISODES)):
+        others = np.delete(np.arange(count), ref)
+        r = batch[ref]
+        corr = np.fft.irfft(spectra[others] * np.conj(spectra[ref]), n_fft)
+        lags = corr.argmax(axis=1)
+        lags = np.where(lags < length, lags, lags - n_fft)
+
+        idx = np.arange(length)[None, :] + lags[:, None]
+        valid = (idx >= 0) & (idx < length)
+        aligned = np.where(valid, batch[others[:, None], idx.clip(0, length - 1)], 0)
+
+        w = LOCAL_WINDOW
+        sx = _window_sums(r, w)
+        sy = _window_sums(aligned, w)
+        sxy = _window_sums(aligned * r, w)
+        sxx = _window_sums(r * r, w)
+        syy = _window_sums(aligned * aligned, w)
+        cov = sxy - sx * sy / w
+        var = (sxx - sx * sx / w) * (syy - sy * sy / w)
+        local = cov / np.sqrt(np.maximum(var, EPS))
+        local[_window_sums(valid.astype(np.float32), w) < w] = 0
+
+        support = (local > LOCAL_THRESHOLD).mean(axis=0)
+        start, end = _longest_run(support >= SUPPORT_THRESHOLD)
+        # Окно проходит порог, когда заставка занимает примерно его половину
+        start, end = start + w // 2, end + w // 2
+        seconds = (end - start) / ENVELOPE_HZ
+        if not INTRO_MIN_SECONDS <= seconds <= INTRO_MAX_SECONDS:
+            continue
+        if best is None or end - start > len(best):
+            best = r[start:end].copy()
+    return best
+
+
+def load_template(conn, show):
+    row = conn.execute('SELECT template FROM show_intros WHERE show = ?', (show,)).fetchone()
+    return np.frombuffer(row[0], dtype=np.float32) if row else None
+
+
+def _extract_all(full_paths):
+    """Огибающие в потоках: работу делает ffmpeg, потоку остаётся ждать его."""
+    with ThreadPoolExecutor(max_workers=EXTRACT_THREADS) as threads:
+        return list(threads.map(extract_envelope, full_paths))
+
+
+def analyze_show(paths, template=None):
+    """Выполняется в пуле процессов, в базу не пишет. paths: {rel_path: полный путь}.
+    Без шаблона ищет его по всем переданным сериям. Возвращает
+    (шаблон или None, {rel_path: (начало, конец, оценка)}) — начало и конец None,
+    если заставка не найдена или звук не прочитался."""
+    envelopes = dict(zip(paths, _extract_all(list(paths.values()))))
+    loaded = {p: env for p, env in envelopes.items() if env is not None}
+    if template is None and len(loaded) >= INTRO_MIN_EPISODES:
+        template = detect_template(_stack(list(loaded.values())))
+
+    results = {p: (None, None, 0.0) for p in paths}
+    if template is not None and loaded:
+        positions, scores = match_template(_stack(list(loaded.values())), template)
+        for rel_path, position, score in zip(loaded, positions, scores):
+            if score >= MATCH_THRESHOLD:
+                results[rel_path] = (position / ENVELOPE_HZ, (position + len(template)) / ENVELOPE_HZ, float(score))
+            else:
+                results[rel_path] = (None, None, float(score))
+    return template, results
+
+
+def get_pending_by_show():
+    """Сериалы с новыми или изменившимися файлами: {сериал: (новые, уже разобранные)},
+    оба — {rel_path: fingerprint}."""
+    conn = get_db()
+    analyzed = dict(conn.execute('SELECT file_path, fingerprint FROM intro_offsets').fetchall())
+    conn.close()
+    shows = {}
+    for full_path in get_all_videos():
+        rel_path = rel_video_path(full_path)
+        try:
+            fingerprint = file_fingerprint(full_path)
+        except OSError:
+            continue
+        new, done = shows.setdefault(get_show_name(full_path), ({}, {}))
+        (done if analyzed.get(rel_path) == fingerprint else new)[rel_path] = fingerprint
+    return {show: files for show, files in shows.items() if show and files[0]}
+
+
+def _save_results(conn, show, fingerprints, template, results):
+    if template is not None:
+        conn.execute(
+            'INSERT OR REPLACE INTO show_intros (show, template, duration, updated_at) VALUES (?, ?, ?, ?)',
+            (show, template.astype(np.float32).tobytes(), len(template) / ENVELOPE_HZ, datetime.now())
+        )
+    conn.executemany(
+        'INSERT OR REPLACE INTO intro_offsets (file_path, fingerprint, intro_start, intro_end, score, analyzed_at) '
+        'VALUES (?, ?, ?, ?, ?, ?)',
+        [
+            (rel_path, fingerprints[rel_path], start, end, score, datetime.now())
+            for rel_path, (start, end, score) in results.items()
+        ]
+    )
+    conn.commit()
+    return sum(1 for start, _, _ in results.values() if start is not None)
+
+
+def analyze_new_files():
+    """Один проход: разбор каждого сериала — отдельная задача в пуле процессов,
+    чтобы FFT не занимал процесс веб-сервера. Записи в базу делает только он сам."""
+    pending = get_pending_by_show()
+    if not pending:
+        return 0
+    found = 0
+    conn = get_db()
+    jobs = {}
+    # spawn: процесс сервера многопоточный, fork от него небезопасен
+    with ProcessPoolExecutor(max_workers=INTRO_WORKERS, mp_context=multiprocessing.get_context("spawn")) as pool:
+        for show, (new, done) in pending.items():
+            template = load_template(conn, show)
+            targets = dict(new)
+            if template is None:
+                # Шаблона ещё нет: ищем его заново вместе с уже разобранными сериями
+                for rel_path in random.sample(sorted(done), min(len(done), DETECT_EXTRA_EPISODES)):
+                    targets[rel_path] = done[rel_path]
+            future = pool.submit(analyze_show, {p: resolve_video_path(p) for p in targets}, template)
+            jobs[future] = (show, targets, template is None, done)
+
+        follow_up = {}
+        for future in as_completed(jobs):
+            show, targets, detecting, done = jobs[future]
+            try:
+                template, results = future.result()
+            except Exception as e:
+                print(f"[INTRO] {show}: analysis failed: {e}", flush=True)
+                continue
+            found += _save_results(conn, show, targets, template if detecting else None, results)
+            print(f"[INTRO] {show}: {len(results)} files analyzed", flush=True)
+            rest = {p: fp for p, fp in done.items() if p not in targets}
+            if detecting and template is not None and rest:
+                # Шаблон появился только сейчас: прежние серии записаны «без заставки»
+                # и по отпечатку не изменятся — сверяем с шаблоном и их
+                future = pool.submit(analyze_show, {p: resolve_video_path(p) for p in rest}, template)
+                follow_up[future] = (show, rest)
+
+        for future in as_completed(follow_up):
+            show, rest = follow_up[future]
+            try:
+                _, results = future.result()
+            except Exception as e:
+                print(f"[INTRO] {show}: matching failed: {e}", flush=True)
+                continue
+            found += _save_results(conn, show, rest, None, results)
+            print(f"[INTRO] {show}: {len(results)} earlier files matched to the new template", flush=True)
+    conn.close()
+    return found
+
+
+def get_intro(rel_path):
+    """(начало, конец) заставки в секундах или None."""
+    conn = get_db()
+    row = conn.execute(
+        'SELECT intro_start, intro_end FROM intro_offsets WHERE file_path = ? AND intro_end IS NOT NULL',
+        (rel_path,)
+    ).fetchone()
+    conn.close()
+    return (row[0], row[1]) if row else None
@@ -1,10 +1,18 @@
 import os
+import asyncio
 from fastapi import FastAPI, Request
 from fastapi.responses import HTMLResponse
 from fastapi.staticfiles import StaticFiles
-from config import STATIC_DIR
-from db import init_db
-from routes import auth, video, admin, proxy
+from config import (
+    STATIC_DIR, HISTORY_COMPACT_INTERVAL_HOURS, STORAGE_AUTO_EVICT, STORAGE_CHECK_INTERVAL_MINUTES,
+    FASTSTART_REMUX, FASTSTART_REMUX_INTERVAL_MINUTES, INTRO_ANALYSIS_INTERVAL_MINUTES
+)
+from db import init_db, compact_history
+from storage import auto_evict
+from hotcache import prefetch_worker
+from remux import remux_pending
+from intros import analyze_new_files
+from routes import auth, video, admin, proxy, channels
 
 app = FastAPI()
 
@@ -24,6 +32,57 @@ app.include_router(auth.router)
 app.include_router(video.router)
 app.include_router(admin.router)
 app.include_router(proxy.router)
+app.include_router(channels.router)
+
+
+async def history_compaction_loop():
+    while True:
+        try:
+            removed = await asyncio.to_thread(compact_history)
+            print(f"[HISTORY] Compaction done: {removed} rows removed", flush=True)
+        except Exception as e:
+            print(f"[HISTORY] Compaction failed: {e}", flush=True)
+        await asyncio.sleep(HISTORY_COMPACT_INTERVAL_HOURS * 3600)
+
+
+async def storage_eviction_loop():
+    while True:
+        try:
+            await asyncio.to_thread(auto_evict)
+        except Exception as e:
+            print(f"[STORAGE] Auto-eviction failed: {e}", flush=True)
+        await asyncio.sleep(STORAGE_CHECK_INTERVAL_MINUTES * 60)
+
+
+async def faststart_remux_loop():
+    while True:
+        try:
+            await asyncio.to_thread(remux_pending)
+        except Exception as e:
+            print(f"[REMUX] Pass failed: {e}", flush=True)
+        await asyncio.sleep(FASTSTART_REMUX_INTERVAL_MINUTES * 60)
+
+
+async def intro_analysis_loop():
+    while True:
+        try:
+            found = await asyncio.to_thread(analyze_new_files)
+            if found:
+                print(f"[INTRO] Intros found in {found} new files", flush=True)
+        except Exception as e:
+            print(f"[INTRO] Analysis failed: {e}", flush=True)
+        await asyncio.sleep(INTRO_ANALYSIS_INTERVAL_MINUTES * 60)
+
+
+@app.on_event("startup")
+async def start_background_jobs():
+    asyncio.create_task(history_compaction_loop())
+    asyncio.create_task(prefetch_worker())
+    if STORAGE_AUTO_EVICT:
+        asyncio.create_task(storage_eviction_loop())
+    if FASTSTART_REMUX:
+        asyncio.create_task(faststart_remux_loop())
+    asyncio.create_task(intro_analysis_loop())
 
 
 @app.get("/", response_class=HTMLResponse)
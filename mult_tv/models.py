@@ -27,3 +27,17 @@ class PlayRequest(BaseModel):
 class ReportRequest(BaseModel):
     file_path: str
     comment: str
+
+
+class EvictRequest(BaseModel):
+    paths: list[str] = []
+    proposal: bool = False  # удалить всё, что сейчас предлагает propose_eviction
+
+
+class ReclaimPair(BaseModel):
+    keep: str
+    remove: str
+
+
+class ReclaimRequest(BaseModel):
+    pairs: list[ReclaimPair]
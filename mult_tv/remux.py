@@ -0,0 +1,92 @@
+import os
+import subprocess
+from db import get_db
+from video import resolve_video_path, file_fingerprint, probe_mp4_layout, mark_library_changed
+from hotcache import invalidate
+from streaming import is_streaming
+
+REMUX_TIMEOUT = 1800
+
+
+def get_remux_queue():
+    """Проверенные файлы с moov в конце."""
+    conn = get_db()
+    rows = conn.execute(
+        'SELECT file_path FROM video_checks WHERE ok = 1 AND faststart = 0 ORDER BY file_path'
+    ).fetchall()
+    conn.close()
+    return [row[0] for row in rows]
+
+
+def _set_layout(rel_path, faststart, fingerprint=None, size_mb=None):
+    conn = get_db()
+    if fingerprint is None:
+        conn.execute('UPDATE video_checks SET faststart = ? WHERE file_path = ?', (faststart, rel_path))
+    else:
+        conn.execute(
+            'UPDATE video_checks SET faststart = ?, fingerprint = ?, size_mb = ? WHERE file_path = ?',
+            (faststart, fingerprint, size_mb, rel_path)
+        )
+    conn.commit()
+    conn.close()
+
+
+def remux_faststart(rel_path):
+    """Перепаковывает файл на месте без перекодирования, с минимальным
+    приоритетом CPU и диска. Возвращает True при успехе."""
+    full_path = resolve_video_path(rel_path)
+    if not os.path.isfile(full_path):
+        return False
+    tmp_path = full_path + ".faststart.part"
+    try:
+        proc = subprocess.run(
+            [
+                "nice", "-n", "19", "ionice", "-c", "3",
+                "ffmpeg", "-nostdin", "-v", "error", "-i", full_path,
+                "-map", "0", "-c", "copy", "-movflags", "+faststart",
+                "-f", "mp4", "-y", tmp_path
+            ],
+            capture_output=True, text=True, timeout=REMUX_TIMEOUT
+        )
+        ok = proc.returncode == 0 and probe_mp4_layout(tmp_path) == 1
+    except (subprocess.TimeoutExpired, FileNotFoundError) as e:
+        proc = None
+        ok = False
+        print(f"[REMUX] {rel_path}: {e}", flush=True)
+
+    if not ok:
+        if proc is not None and proc.stderr:
+            print(f"[REMUX] {rel_path}: {proc.stderr.strip()[:200]}", flush=True)
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        _set_layout(rel_path, -1)
+        return False
+
+    # Перепаковка идёт долго: за это время файл могли начать смотреть.
+    # Подменять его под открытой раздачей нельзя — откладываем до следующего прохода
+    if is_streaming(rel_path):
+        os.remove(tmp_path)
+        print(f"[REMUX] {rel_path}: started streaming during remux, swap postponed", flush=True)
+        return False
+
+    os.replace(tmp_path, full_path)
+    invalidate(rel_path)
+    _set_layout(
+        rel_path, 1, file_fingerprint(full_path),
+        round(os.path.getsize(full_path) / (1024 * 1024), 1)
+    )
+    mark_library_changed()
+    return True
+
+
+def remux_pending():
+    """Один проход очереди. Файлы, которые сейчас смотрят, пропускаются —
+    у открытых раздач не должны поехать байтовые смещения."""
+    done = 0
+    for rel_path in get_remux_queue():
+        if is_streaming(rel_path):
+            continue
+        if remux_faststart(rel_path):
+            done += 1
+            print(f"[REMUX] faststart: {rel_path}", flush=True)
+    return done
@@ -1,12 +1,20 @@
 import os
+import asyncio
 import sqlite3
 from fastapi import APIRouter, HTTPException, Request
-from config import VIDEO_DIR
+from config import VIDEO_DIRS
 from db import get_db
 from auth import require_admin, hash_password
-from datetime import datetime
-from video import safe_path, get_all_videos_unfiltered, get_show_name, validate_video
-from models import CreateUserRequest, ChangePasswordRequest, PlayRequest
+from video import (
+    safe_path, resolve_video_path, rel_video_path, scan_videos, get_all_videos_unfiltered, get_live_files,
+    get_show_name, validate_video, save_check, file_fingerprint, get_known_duration
+)
+from streaming import get_stream_stats
+from hotcache import get_cache_stats
+from transcode import get_transcode_stats
+from dedupe import find_duplicates, reclaim_duplicates
+from storage import get_storage_report, propose_eviction, purge_files
+from models import CreateUserRequest, ChangePasswordRequest, PlayRequest, EvictRequest, ReclaimRequest
 
 router = APIRouter(prefix="/api/admin")
 
@@ -73,16 +81,18 @@ async def get_stats(request: Request):
     total_users = conn.execute('SELECT COUNT(*) FROM users').fetchone()[0]
     total_views = conn.execute('SELECT COUNT(*) FROM history').fetchone()[0]
 
-    total_videos = 0
-    for root, dirs, files in os.walk(VIDEO_DIR):
-        for file in files:
-            if file.lower().endswith('.mp4'):
-                total_videos += 1
+    total_videos = len(scan_videos())
 
     conn.close()
     return {"total_users": total_users, "total_views": total_views, "total_videos": total_videos}
 
 
+@router.get("/streams")
+async def list_streams(request: Request):
+    require_admin(request)
+    return {**get_stream_stats(), "hot_cache": get_cache_stats(), "transcodes": get_transcode_stats()}
+
+
 @router.delete("/history")
 async def reset_history(request: Request):
     require_admin(request)
@@ -96,47 +106,80 @@ async def reset_history(request: Request):
 @router.delete("/videos/{file_path:path}")
 async def delete_video(file_path: str, request: Request):
     require_admin(request)
-    full_path = safe_path(VIDEO_DIR, file_path)
+    full_path = resolve_video_path(file_path)
     if not os.path.isfile(full_path):
         raise HTTPException(status_code=404)
-    os.remove(full_path)
+    if not purge_files([file_path])["removed"]:
+        raise HTTPException(status_code=409, detail="File is being streamed or could not be deleted")
     return {"ok": True}
 
 
+@router.get("/storage")
+async def storage_report(request: Request):
+    require_admin(request)
+    return await asyncio.to_thread(get_storage_report)
+
+
+@router.post("/storage/evict")
+async def storage_evict(data: EvictRequest, request: Request):
+    require_admin(request)
+    if data.proposal:
+        paths = [p["path"] for p in await asyncio.to_thread(propose_eviction)]
+    else:
+        paths = data.paths
+    return await asyncio.to_thread(purge_files, paths)
+
+
+@router.get("/duplicates")
+async def list_duplicates(request: Request):
+    require_admin(request)
+    return await asyncio.to_thread(find_duplicates)
+
+
+@router.post("/duplicates/reclaim")
+async def reclaim_duplicate_files(data: ReclaimRequest, request: Request):
+    require_admin(request)
+    return await asyncio.to_thread(reclaim_duplicates, [(p.keep, p.remove) for p in data.pairs])
+
+
 @router.get("/browse")
 async def browse_files(request: Request, path: str = ""):
     require_admin(request)
-    full_path = safe_path(VIDEO_DIR, path)
-    if not os.path.isdir(full_path):
+    # Одна и та же папка может существовать на нескольких дисках — сливаем содержимое
+    dirs = [d for d in (safe_path(root, path) for root in VIDEO_DIRS) if os.path.isdir(d)]
+    if not dirs:
         raise HTTPException(status_code=404, detail="Directory not found")
 
-    folders = []
-    files = []
-    for entry in sorted(os.listdir(full_path)):
-        if entry.startswith('.'):
-            continue
-        entry_path = os.path.join(full_path, entry)
-        if os.path.isdir(entry_path):
-            folders.append(entry)
-        elif entry.lower().endswith('.mp4'):
-            rel = os.path.relpath(entry_path, VIDEO_DIR)
-            size_mb = round(os.path.getsize(entry_path) / (1024 * 1024), 1)
-            files.append({"name": entry, "path": rel, "size_mb": size_mb})
+    folders = set()
+    files = {}
+    for full_path in dirs:
+        for entry in os.listdir(full_path):
+            if entry.startswith('.'):
+                continue
+            entry_path = os.path.join(full_path, entry)
+            if os.path.isdir(entry_path):
+                folders.add(entry)
+            elif entry.lower().endswith('.mp4') and entry not in files:
+                rel = rel_video_path(entry_path)
+                size_mb = round(os.path.getsize(entry_path) / (1024 * 1024), 1)
+                files[entry] = {"name": entry, "path": rel, "size_mb": size_mb}
 
-    return {"current_path": path, "folders": folders, "files": files}
+    return {"current_path": path, "folders": sorted(folders), "files": [files[name] for name in sorted(files)]}
 
 
 @router.post("/play")
 async def play_video(data: PlayRequest, request: Request):
     require_admin(request)
-    full_path = safe_path(VIDEO_DIR, data.path)
+    full_path = resolve_video_path(data.path)
     if not os.path.isfile(full_path) or not data.path.lower().endswith('.mp4'):
         raise HTTPException(status_code=404, detail="Video not found")
 
+    stream_prefix = "/live" if data.path in get_live_files() else "/stream"
     return {
         "title": os.path.basename(full_path),
-        "url": f"/stream/{data.path}",
-        "file_path": data.path
+        "url": f"{stream_prefix}/{data.path}",
+        "file_path": data.path,
+        "duration": get_known_duration(data.path)
     }
 
 
@@ -144,13 +187,9 @@ async def play_video(data: PlayRequest, request: Request):
 async def list_videos(request: Request):
     require_admin(request)
     videos = []
-    for root, dirs, files in os.walk(VIDEO_DIR):
-        for file in files:
-            if file.lower().endswith('.mp4'):
-                full_path = os.path.join(root, file)
-                rel_path = os.path.relpath(full_path, VIDEO_DIR)
-                size_mb = round(os.path.getsize(full_path) / (1024 * 1024), 1)
-                videos.append({"name": file, "path": rel_path, "size_mb": size_mb})
+    for rel_path, full_path in sorted(scan_videos().items()):
+        size_mb = round(os.path.getsize(full_path) / (1024 * 1024), 1)
+        videos.append({"name": os.path.basename(full_path), "path": rel_path, "size_mb": size_mb})
     return videos
 
 
@@ -178,21 +217,35 @@ async def delete_report(report_id: int, request: Request):
     return {"ok": True}
 
 
+# deep_ok отдаётся только если глубокая проверка делалась для текущей версии файла
+CHECKS_QUERY = (
+    'SELECT file_path, ok, errors, video_codec, audio_codec, duration, size_mb, faststart, checked_at, '
+    'CASE WHEN deep_fingerprint = fingerprint THEN deep_ok END AS deep_ok, deep_errors '
+    'FROM video_checks ORDER BY ok ASC, file_path ASC'
+)
+
+
+def _is_failed(check):
+    return not check["ok"] or check["deep_ok"] == 0
+
+
 @router.get("/checks")
 async def get_checks(request: Request):
     require_admin(request)
     conn = get_db()
-    rows = conn.execute(
-        'SELECT file_path, ok, errors, video_codec, audio_codec, duration, size_mb, checked_at '
-        'FROM video_checks ORDER BY ok ASC, file_path ASC'
-    ).fetchall()
+    rows = conn.execute(CHECKS_QUERY).fetchall()
     conn.close()
     return [dict(row) for row in rows]
 
 
-@router.get("/validate")
-async def validate_videos(request: Request, mode: str = "new"):
-    require_admin(request)
+def _fingerprint_or_none(file_path):
+    try:
+        return file_fingerprint(file_path)
+    except OSError:
+        return None
+
+
+def _run_validation(mode):
     conn = get_db()
 
     all_files = get_all_videos_unfiltered()
@@ -202,34 +255,27 @@ async def validate_videos(request: Request, mode: str = "new"):
         conn.commit()
         to_check = all_files
     else:
-        checked = {row[0] for row in conn.execute('SELECT file_path FROM video_checks').fetchall()}
-        to_check = [f for f in all_files if os.path.relpath(f, "/downloads") not in checked]
+        # new — новые и изменившиеся файлы; deep — файлы без глубокой проверки текущей версии
+        column = "deep_fingerprint" if mode == "deep" else "fingerprint"
+        checked = {
+            row[0]: row[1]
+            for row in conn.execute(f'SELECT file_path, {column} FROM video_checks').fetchall()
+        }
+        to_check = [f for f in all_files if checked.get(rel_video_path(f)) != _fingerprint_or_none(f)]
 
     total_to_check = len(to_check)
     print(f"[VALIDATE] Starting: {total_to_check} files to check (mode={mode})", flush=True)
 
     results = []
     for i, f in enumerate(to_check, 1):
-        rel_path = os.path.relpath(f, "/downloads")
-        check = validate_video(f)
-        status = "OK " if check["ok"] else "ERR"
-        errors_str = f' — {"; ".join(check["errors"])}' if check["errors"] else ""
+        rel_path = rel_video_path(f)
+        check = validate_video(f, deep=mode == "deep")
+        failed = not check["ok"] or check.get("deep_ok") is False
+        status = "ERR" if failed else "OK "
+        errors = check["errors"] + check.get("deep_errors", [])
+        errors_str = f' — {"; ".join(errors)}' if errors else ""
         print(f"[VALIDATE] {i}/{total_to_check} {status} {rel_path}{errors_str}", flush=True)
-        conn.execute(
-            'INSERT OR REPLACE INTO video_checks '
-            '(file_path, ok, errors, video_codec, audio_codec, duration, size_mb, checked_at) '
-            'VALUES (?, ?, ?, ?, ?, ?, ?, ?)',
-            (
-                rel_path,
-                1 if check["ok"] else 0,
-                "; ".join(check["errors"]),
-                check["video_codec"],
-                check["audio_codec"],
-                check["duration"],
-                check["size_mb"],
-                datetime.now(),
-            )
-        )
+        save_check(conn, rel_path, check)
         results.append({
             "file": rel_path,
             "show": get_show_name(f),
@@ -238,20 +284,17 @@ async def validate_videos(request: Request, mode: str = "new"):
 
     conn.commit()
 
-    ok_now = sum(1 for r in results if r.get("ok"))
-    err_now = len(results) - ok_now
+    err_now = sum(1 for r in results if not r["ok"] or r.get("deep_ok") is False)
+    ok_now = len(results) - err_now
     print(f"[VALIDATE] Done: {ok_now} ok, {err_now} errors", flush=True)
 
     # Вернуть полную картину
-    all_rows = conn.execute(
-        'SELECT file_path, ok, errors, video_codec, audio_codec, duration, size_mb, checked_at '
-        'FROM video_checks ORDER BY ok ASC, file_path ASC'
-    ).fetchall()
+    all_rows = conn.execute(CHECKS_QUERY).fetchall()
     conn.close()
 
     all_checks = [dict(row) for row in all_rows]
-    ok_count = sum(1 for r in all_checks if r["ok"])
-    error_count = len(all_checks) - ok_count
+    error_count = sum(1 for r in all_checks if _is_failed(r))
+    ok_count = len(all_checks) - error_count
 
     return {
         "checked_now": len(results),
@@ -260,3 +303,10 @@ async def validate_videos(request: Request, mode: str = "new"):
         "error_count": error_count,
         "results": all_checks,
     }
+
+
+@router.get("/validate")
+async def validate_videos(request: Request, mode: str = "new"):
+    require_admin(request)
+    # ffprobe/ffmpeg по всей библиотеке — в отдельном потоке, чтобы не стопорить раздачу
+    return await asyncio.to_thread(_run_validation, mode)
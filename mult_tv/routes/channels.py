@@ -0,0 +1,37 @@
+import os
+from fastapi import APIRouter, HTTPException, Request
+from config import VIDEO_DIR, CHANNELS
+from auth import require_auth
+from video import get_show_name
+from channels import whats_on, up_next
+from hotcache import schedule_prefetch
+
+router = APIRouter(prefix="/api/channels")
+
+
+@router.get("")
+async def list_channels(request: Request):
+    require_auth(request)
+    return [{"name": name, "shows": shows} for name, shows in CHANNELS.items()]
+
+
+@router.get("/{name}")
+async def tune_channel(name: str, request: Request):
+    require_auth(request)
+    if name not in CHANNELS:
+        raise HTTPException(status_code=404, detail="Channel not found")
+    on_air = whats_on(name)
+    if not on_air:
+        return {"error": "В эфире пусто"}
+    rel_path, offset, duration = on_air
+    schedule_prefetch([p for p in (up_next(name),) if p])
+    full_path = os.path.join(VIDEO_DIR, rel_path)
+    return {
+        "title": os.path.basename(rel_path),
+        "url": f"/stream/{rel_path}",
+        "file_path": rel_path,
+        "show": get_show_name(full_path),
+        "channel": name,
+        "start_offset": round(offset, 1),
+        "duration": duration,
+    }
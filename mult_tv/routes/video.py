@@ -2,11 +2,17 @@ import os
 import random
 from datetime import datetime, timedelta
 from fastapi import APIRouter, HTTPException, Request
-from fastapi.responses import FileResponse
 from config import VIDEO_DIR
 from db import get_db
 from auth import require_auth
-from video import safe_path, get_show_name, get_all_videos, get_sorted_shows, pick_from_show
+from streaming import stream_file
+from transcode import live_remux_response
+from video import (
+    resolve_video_path, rel_video_path, get_show_name, get_all_videos, get_live_files,
+    get_sorted_shows, get_next_show, pick_from_show, group_by_show, get_known_duration
+)
+from hotcache import cached_paths, prefetch_next
+from intros import get_intro
 from models import MarkWatchedRequest, ReportRequest
 
 router = APIRouter()
@@ -27,7 +33,7 @@ async def get_random_video(request: Request, current_path: str = "", same_folder
 
     ten_days_ago = datetime.now() - timedelta(days=10)
     cursor.execute('SELECT file_path FROM history WHERE watched_at > ?', (ten_days_ago,))
-    recently_watched = [row[0] for row in cursor.fetchall()]
+    recently_watched = {row[0] for row in cursor.fetchall()}
 
     all_files = get_all_videos()
 
@@ -36,47 +42,68 @@ async def get_random_video(request: Request, current_path: str = "", same_folder
         return {"error": "Папка загрузок пуста"}
 
     chosen_video = None
+    live = get_live_files()
+    shows = get_sorted_shows()
+    by_show = group_by_show(all_files)
+    # Головы /live-файлов из кэша не раздаются — их не предпочитаем и не греем
+    hot = cached_paths() - live
 
     if show:
-        chosen_video = pick_from_show(show, all_files, recently_watched)
+        chosen_video = pick_from_show(show, by_show, recently_watched, hot)
     elif current_path and same_folder:
         current_show = get_show_name(os.path.join(VIDEO_DIR, current_path))
-        chosen_video = pick_from_show(current_show, all_files, recently_watched)
+        chosen_video = pick_from_show(current_show, by_show, recently_watched, hot)
     elif current_path:
         current_show = get_show_name(os.path.join(VIDEO_DIR, current_path))
-        shows = get_sorted_shows()
-        if shows:
-            try:
-                idx = shows.index(current_show)
-                next_show = shows[(idx + 1) % len(shows)]
-            except ValueError:
-                next_show = shows[0]
-            chosen_video = pick_from_show(next_show, all_files, recently_watched)
+        next_show = get_next_show(current_show, shows)
+        if next_show:
+            chosen_video = pick_from_show(next_show, by_show, recently_watched, hot)
 
     if not chosen_video:
-        available = [f for f in all_files if f not in recently_watched]
+        available = [f for f in all_files if rel_video_path(f) not in recently_watched]
         if not available:
             available = all_files
         chosen_video = random.choice(available)
 
     conn.close()
 
-    rel_path = os.path.relpath(chosen_video, VIDEO_DIR)
+    rel_path = rel_video_path(chosen_video)
+    chosen_show = get_show_name(chosen_video)
+    # Прогреваем кандидатов на следующее переключение, пока идёт эта серия
+    prefetch_next(chosen_show, by_show, recently_watched | {rel_path}, shows, live)
+
+    stream_prefix = "/live" if rel_path in live else "/stream"
+    # Живой ремукс не перематывается — заставку в нём не пропустить
+    intro = get_intro(rel_path) if stream_prefix == "/stream" else None
     return {
         "title": os.path.basename(chosen_video),
-        "url": f"/stream/{rel_path}",
+        "url": f"{stream_prefix}/{rel_path}",
         "file_path": rel_path,
-        "show": get_show_name(chosen_video)
+        "show": chosen_show,
+        "duration": get_known_duration(rel_path),
+        "intro_start": intro[0] if intro else None,
+        "skip_to": intro[1] if intro else None
     }
 
 
 @router.get("/stream/{file_path:path}")
 async def stream_video(file_path: str, request: Request):
-    require_auth(request)
-    full_path = safe_path(VIDEO_DIR, file_path)
+    user = require_auth(request)
+    full_path = resolve_video_path(file_path)
+    if not os.path.isfile(full_path):
+        raise HTTPException(status_code=404)
+    return stream_file(
+        full_path, file_path, user["username"], request.headers.get("range"), request.headers.get("if-range")
+    )
+
+
+@router.get("/live/{file_path:path}")
+async def live_stream(file_path: str, request: Request):
+    user = require_auth(request)
+    full_path = resolve_video_path(file_path)
     if not os.path.isfile(full_path):
         raise HTTPException(status_code=404)
-    return FileResponse(full_path)
+    return await live_remux_response(full_path, file_path, user["username"])
 
 
 @router.post("/api/mark_watched")
@@ -0,0 +1,184 @@
+import os
+import shutil
+from datetime import datetime, timedelta
+from config import (
+    VIDEO_DIRS, STORAGE_HIGH_WATER, STORAGE_LOW_WATER, STORAGE_PROTECT_DAYS
+)
+from db import get_db
+from video import scan_videos, video_root, get_show_name, resolve_video_path, mark_library_changed
+from hotcache import invalidate
+from streaming import is_streaming
+
+
+def get_disks():
+    """Заполненность дисков с библиотекой. Корни на одном устройстве считаются один раз."""
+    disks = {}
+    for root in VIDEO_DIRS:
+        try:
+            device = os.stat(root).st_dev
+            usage = shutil.disk_usage(root)
+        except OSError:
+            continue
+        disk = disks.setdefault(device, {
+            "roots": [], "total": usage.total, "used": usage.used, "free": usage.free,
+        })
+        disk["roots"].append(root)
+    for disk in disks.values():
+        disk["ratio"] = round(disk["used"] / disk["total"], 3) if disk["total"] else 0
+    return list(disks.values())
+
+
+def get_watch_stats():
+    """{file_path: (последний просмотр, число просмотров)} по истории."""
+    conn = get_db()
+    rows = conn.execute(
+        'SELECT file_path, MAX(watched_at), COUNT(*) FROM history GROUP BY file_path'
+    ).fetchall()
+    conn.close()
+    stats = {}
+    for path, last, count in rows:
+        try:
+            stats[path] = (datetime.fromisoformat(last), count)
+        except (ValueError, TypeError):
+            stats[path] = (None, count)
+    return stats
+
+
+def get_library_files():
+    """Файлы библиотеки с размером, сериалом и корнем."""
+    files = []
+    for rel_path, full_path in scan_videos().items():
+        try:
+            st = os.stat(full_path)
+        except OSError:
+            continue
+        files.append({
+            "path": rel_path,
+            "full_path": full_path,
+            "root": video_root(full_path),
+            "show": get_show_name(full_path),
+            "size": st.st_size,
+            "mtime": datetime.fromtimestamp(st.st_mtime),
+        })
+    return files
+
+
+def usage_by_show(files=None):
+    shows = {}
+    for f in files if files is not None else get_library_files():
+        entry = shows.setdefault(f["show"], {"show": f["show"], "files": 0, "size_mb": 0.0})
+        entry["files"] += 1
+        entry["size_mb"] += f["size"] / (1024 * 1024)
+    for entry in shows.values():
+        entry["size_mb"] = round(entry["size_mb"], 1)
+    return sorted(shows.values(), key=lambda s: s["size_mb"], reverse=True)
+
+
+def eviction_score(last_seen, views, now):
+    """Чем дольше файл не смотрели и чем реже смотрели — тем выше шанс удаления."""
+    age_days = (now - last_seen).total_seconds() / 86400
+    return age_days / (1 + views)
+
+
+def propose_eviction(files=None, disks=None):
+    """Кандидаты на удаление для дисков выше STORAGE_HIGH_WATER — пока диск не опустится
+    до STORAGE_LOW_WATER. Непросмотренные файлы стареют от даты появления на диске."""
+    files = files if files is not None else get_library_files()
+    disks = disks if disks is not None else get_disks()
+    watch_stats = get_watch_stats()
+    now = datetime.now()
+    protect_after = now - timedelta(days=STORAGE_PROTECT_DAYS)
+
+    proposal = []
+    for disk in disks:
+        if disk["ratio"] < STORAGE_HIGH_WATER:
+            continue
+        to_free = disk["used"] - STORAGE_LOW_WATER * disk["total"]
+        candidates = []
+        for f in files:
+            if f["root"] not in disk["roots"]:
+                continue
+            last_watched, views = watch_stats.get(f["path"], (None, 0))
+            last_seen = max(filter(None, (last_watched, f["mtime"])))
+            # Первый просмотр старого файла ещё не в истории (пишется на 50%) — смотрим раздачи
+            if last_seen > protect_after or is_streaming(f["path"]):
+                continue
+            candidates.append((eviction_score(last_seen, views, now), f, last_watched, views))
+        candidates.sort(key=lambda c: c[0], reverse=True)
+        for score, f, last_watched, views in candidates:
+            if to_free <= 0:
+                break
+            to_free -= f["size"]
+            proposal.append({
+                "path": f["path"],
+                "show": f["show"],
+                "size_mb": round(f["size"] / (1024 * 1024), 1),
+                "last_watched": last_watched.isoformat(sep=" ", timespec="seconds") if last_watched else None,
+                "views": views,
+                "score": round(score, 1),
+            })
+    return proposal
+
+
+def purge_files(rel_paths, move_history=None):
+    """Удаляет файлы с диска и одной транзакцией чистит связанные строки
+    (video_checks, history, file_hashes, intro_offsets), чтобы каталог не ссылался на удалённое.
+    Файлы, которые сейчас смотрят, пропускаются. move_history — {удаляемый: оставляемый}:
+    история таких файлов не удаляется, а переносится, и только если файл действительно удалён."""
+    removed = []
+    freed = 0
+    for rel_path in rel_paths:
+        full_path = resolve_video_path(rel_path)
+        if not os.path.isfile(full_path):
+            continue
+        if is_streaming(rel_path):
+            print(f"[STORAGE] Skipping {rel_path}: being streamed", flush=True)
+            continue
+        try:
+            size = os.path.getsize(full_path)
+            os.remove(full_path)
+        except OSError as e:
+            print(f"[STORAGE] Failed to delete {rel_path}: {e}", flush=True)
+            continue
+        invalidate(rel_path)
+        removed.append(rel_path)
+        freed += size
+
+    if removed:
+        conn = get_db()
+        params = [(p,) for p in removed]
+        if move_history:
+            conn.executemany(
+                'UPDATE history SET file_path = ? WHERE file_path = ?',
+                [(move_history[p], p) for p in removed if p in move_history]
+            )
+        conn.executemany('DELETE FROM video_checks WHERE file_path = ?', params)
+        conn.executemany('DELETE FROM history WHERE file_path = ?', params)
+        conn.executemany('DELETE FROM file_hashes WHERE file_path = ?', params)
+        conn.executemany('DELETE FROM intro_offsets WHERE file_path = ?', params)
+        conn.commit()
+        conn.close()
+        mark_library_changed()
+    return {"removed": removed, "freed_mb": round(freed / (1024 * 1024), 1)}
+
+
+def get_storage_report():
+    files = get_library_files()
+    disks = get_disks()
+    return {
+        "high_water": STORAGE_HIGH_WATER,
+        "low_water": STORAGE_LOW_WATER,
+        "disks": disks,
+        "shows": usage_by_show(files),
+        "proposal": propose_eviction(files, disks),
+    }
+
+
+def auto_evict():
+    """Фоновая проверка: при переполнении удаляет предложенные файлы."""
+    proposal = propose_eviction()
+    if not proposal:
+        return None
+    result = purge_files([p["path"] for p in proposal])
+    print(f"[STORAGE] Auto-evicted {len(result['removed'])} files, freed {result['freed_mb']} MB", flush=True)
+    return result
@@ -0,0 +1,271 @@
+import os
+import time
+from email.utils import formatdate
+import asyncio
+import itertools
+from collections import deque
+from fastapi import HTTPException
+from fastapi.responses import StreamingResponse
+from config import (
+    UPLINK_BYTES_PER_SEC, STREAM_MAX_PER_USER, STREAM_RATE_HEADROOM, STREAM_BURST_SECONDS,
+    STREAM_DEFAULT_BITRATE, STREAM_CHUNK_SIZE, STREAM_IDLE_TIMEOUT, STREAM_EVICT_IDLE_SECONDS
+)
+from db import get_db
+from hotcache import get_head, record_request, stats as hotcache_stats
+from video import file_fingerprint
+
+THROUGHPUT_WINDOW = 5  # секунд для скользящего среднего в админке
+
+_ids = itertools.count(1)
+active_streams = {}  # stream id -> Stream
+
+
+class Stream:
+    """Одна HTTP-раздача файла с собственным token bucket."""
+
+    def __init__(self, username, file_path, bitrate):
+        self.id = next(_ids)
+        self.username = username
+        self.file_path = file_path
+        self.bitrate = bitrate
+        self.rate = bitrate * STREAM_RATE_HEADROOM
+        self.tokens = self.rate * STREAM_BURST_SECONDS
+        self.refilled = time.monotonic()
+        self.last_active = self.refilled
+        self.started = self.refilled
+        self.sent = 0
+        self.cancelled = False
+        self.window = deque()  # (время, байты)
+
+    def _refill(self):
+        now = time.monotonic()
+        capacity = self.rate * STREAM_BURST_SECONDS
+        self.tokens = min(capacity, self.tokens + (now - self.refilled) * self.rate)
+        self.refilled = now
+
+    async def throttle(self, nbytes):
+        self._refill()
+        while self.tokens < nbytes and not self.cancelled:
+            await asyncio.sleep((nbytes - self.tokens) / self.rate)
+            self._refill()
+        self.tokens -= nbytes
+
+    def record(self, nbytes):
+        now = time.monotonic()
+        self.sent += nbytes
+        self.last_active = now
+        self.window.append((now, nbytes))
+        while self.window and now - self.window[0][0] > THROUGHPUT_WINDOW:
+            self.window.popleft()
+
+    def throughput(self):
+        """Байт/с за последние THROUGHPUT_WINDOW секунд."""
+        now = time.monotonic()
+        recent = sum(n for t, n in self.window if now - t <= THROUGHPUT_WINDOW)
+        return recent / min(THROUGHPUT_WINDOW, max(now - self.started, 1e-3))
+
+
+def get_file_bitrate(rel_path):
+    """Средний битрейт файла (байт/с) по данным ffprobe из video_checks."""
+    conn = get_db()
+    row = conn.execute(
+        'SELECT size_mb, duration FROM video_checks WHERE file_path = ?', (rel_path,)
+    ).fetchone()
+    conn.close()
+    if not row or not row["duration"] or not row["size_mb"]:
+        return STREAM_DEFAULT_BITRATE
+    return row["size_mb"] * 1024 * 1024 / row["duration"]
+
+
+def _prune_idle():
+    now = time.monotonic()
+    stale = [
+        s for s in active_streams.values()
+        if s.cancelled or now - s.last_active > STREAM_IDLE_TIMEOUT
+    ]
+    for stream in stale:
+        stream.cancelled = True
+        active_streams.pop(stream.id, None)
+    if stale:
+        rebalance()
+
+
+def rebalance():
+    """Делит аплинк max-min справедливо между пользователями.
+    Сначала каждый получает спрос (битрейт с запасом) в пределах справедливой доли,
+    остаток делится поровну между всеми активными зрителями."""
+    by_user = {}
+    for stream in active_streams.values():
+        by_user.setdefault(stream.username, []).append(stream)
+    if not by_user:
+        return
+
+    demand = {
+        user: sum(s.bitrate * STREAM_RATE_HEADROOM for s in streams)
+        for user, streams in by_user.items()
+    }
+    allocation = {user: 0.0 for user in by_user}
+    remaining = float(UPLINK_BYTES_PER_SEC)
+    unsatisfied = sorted(by_user, key=lambda u: demand[u])
+    while unsatisfied and remaining > 0:
+        share = remaining / len(unsatisfied)
+        user = unsatisfied[0]
+        if demand[user] <= share:
+            allocation[user] = demand[user]
+            remaining -= demand[user]
+            unsatisfied.pop(0)
+        else:
+            for user in unsatisfied:
+                allocation[user] = share
+            remaining = 0
+            unsatisfied = []
+
+    # Свободная полоса — поровну всем, чтобы быстрее набирать буфер
+    bonus = remaining / len(by_user)
+    for user, streams in by_user.items():
+        user_rate = allocation[user] + bonus
+        user_demand = demand[user]
+        for stream in streams:
+            weight = stream.bitrate * STREAM_RATE_HEADROOM / user_demand
+            stream.rate = max(user_rate * weight, STREAM_CHUNK_SIZE)
+
+
+def open_stream(username, rel_path):
+    """Регистрирует раздачу. При превышении лимита пользователя закрывает его
+    простаивающие раздачи (брошенный запрос после перемотки, пауза); если все
+    раздачи живые — отказывает с 429, а не обрывает чужой ответ на середине."""
+    _prune_idle()
+    own = [s for s in active_streams.values() if s.username == username]
+    if STREAM_MAX_PER_USER > 0 and len(own) >= STREAM_MAX_PER_USER:
+        now = time.monotonic()
+        idle = sorted(
+            (s for s in own if now - s.last_active > STREAM_EVICT_IDLE_SECONDS),
+            key=lambda s: s.last_active
+        )
+        excess = len(own) - STREAM_MAX_PER_USER + 1
+        if len(idle) < excess:
+            raise HTTPException(
+                status_code=429, detail="Too many streams",
+                headers={"Retry-After": str(STREAM_EVICT_IDLE_SECONDS)}
+            )
+        for stale in idle[:excess]:
+            stale.cancelled = True
+            active_streams.pop(stale.id, None)
+    stream = Stream(username, rel_path, get_file_bitrate(rel_path))
+    active_streams[stream.id] = stream
+    rebalance()
+    return stream
+
+
+def is_streaming(rel_path):
+    """Есть ли открытая раздача файла. Такие файлы нельзя удалять или подменять."""
+    return any(s.file_path == rel_path for s in list(active_streams.values()))
+
+
+def close_stream(stream):
+    stream.cancelled = True
+    if active_streams.pop(stream.id, None):
+        rebalance()
+
+
+def parse_range(range_header, file_size):
+    """Разбирает заголовок Range (один диапазон). Возвращает (start, end) включительно или None."""
+    if not range_header:
+        return None
+    unit, _, spec = range_header.partition("=")
+    if unit.strip() != "bytes" or "," in spec:
+        return None
+    start_str, _, end_str = spec.strip().partition("-")
+    try:
+        if start_str:
+            start = int(start_str)
+            end = int(end_str) if end_str else file_size - 1
+        else:
+            start = max(file_size - int(end_str), 0)
+            end = file_size - 1
+    except ValueError:
+        return None
+    end = min(end, file_size - 1)
+    if start > end:
+        raise HTTPException(status_code=416, headers={"Content-Range": f"bytes */{file_size}"})
+    return start, end
+
+
+async def _send_file(stream, full_path, start, end, head=None):
+    """Отдаёт байты [start, end]: из горячего кэша, пока диапазон внутри
+    закэшированного начала, дальше — с диска (файл открывается только тогда)."""
+    f = None
+    try:
+        pos = start
+        while pos <= end and not stream.cancelled:
+            size = min(STREAM_CHUNK_SIZE, end - pos + 1)
+            await stream.throttle(size)
+            if head is not None and pos + size <= len(head):
+                chunk = head[pos:pos + size]
+                hotcache_stats["bytes_served"] += len(chunk)
+            else:
+                if f is None:
+                    f = open(full_path, "rb")
+                    f.seek(pos)
+                chunk = await asyncio.to_thread(f.read, size)
+            if not chunk:
+                break
+            pos += len(chunk)
+            stream.record(len(chunk))
+            yield chunk
+    finally:
+        if f is not None:
+            f.close()
+        close_stream(stream)
+
+
+def stream_file(full_path, rel_path, username, range_header=None, if_range=None):
+    """Отдаёт файл (целиком или Range) через планировщик раздач.
+    ETag/Last-Modified и If-Range нужны, потому что файлы подменяются на месте
+    (faststart, сохранённый ремукс): докачка по старому ETag получит файл целиком,
+    а не куски двух разных файлов."""
+    file_size = os.path.getsize(full_path)
+    etag = f'"{file_fingerprint(full_path)}"'
+    last_modified = formatdate(os.path.getmtime(full_path), usegmt=True)
+    if if_range and if_range not in (etag, last_modified):
+        range_header = None
+    byte_range = parse_range(range_header, file_size)
+    start, end = byte_range or (0, file_size - 1)
+    headers = {
+        "Accept-Ranges": "bytes",
+        "Content-Length": str(end - start + 1),
+        "ETag": etag,
+        "Last-Modified": last_modified,
+    }
+    if byte_range:
+        headers["Content-Range"] = f"bytes {start}-{end}/{file_size}"
+    head = get_head(rel_path, full_path)
+    record_request(start, head)
+    stream = open_stream(username, rel_path)
+    return StreamingResponse(
+        _send_file(stream, full_path, start, end, head),
+        status_code=206 if byte_range else 200,
+        media_type="video/mp4",
+        headers=headers,
+    )
+
+
+def get_stream_stats():
+    """Живые раздачи по пользователям для админки."""
+    _prune_idle()
+    users = {}
+    for stream in active_streams.values():
+        entry = users.setdefault(stream.username, {
+            "username": stream.username, "streams": 0, "throughput_kbps": 0.0, "rate_kbps": 0.0, "files": []
+        })
+        entry["streams"] += 1
+        entry["throughput_kbps"] += stream.throughput() * 8 / 1000
+        entry["rate_kbps"] += stream.rate * 8 / 1000
+        entry["files"].append(stream.file_path)
+    for entry in users.values():
+        entry["throughput_kbps"] = round(entry["throughput_kbps"])
+        entry["rate_kbps"] = round(entry["rate_kbps"])
+    return {
+        "uplink_kbps": round(UPLINK_BYTES_PER_SEC * 8 / 1000),
+        "users": sorted(users.values(), key=lambda u: u["username"]),
+    }
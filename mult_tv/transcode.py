@@ -0,0 +1,152 @@
+import os
+import re
+import json
+import asyncio
+import subprocess
+from fastapi import HTTPException
+from fastapi.responses import StreamingResponse
+from config import LIVE_TRANSCODE_MAX, LIVE_TRANSCODE_KEEP, STREAM_CHUNK_SIZE, AUDIO_LANG_FILTER
+from db import get_db
+from video import SUPPORTED_VIDEO_CODECS, validate_video, save_check
+from streaming import open_stream, close_stream, active_streams
+from hotcache import invalidate
+
+active_transcodes = {}  # id раздачи -> (rel_path, процесс ffmpeg)
+
+
+def get_video_codec(rel_path):
+    conn = get_db()
+    row = conn.execute('SELECT video_codec FROM video_checks WHERE file_path = ?', (rel_path,)).fetchone()
+    conn.close()
+    return row[0] if row else ""
+
+
+def pick_audio_stream(full_path):
+    """Аудиодорожка как в convert.sh: первая, у которой language/title подходит
+    под AUDIO_LANG_FILTER, иначе первая. Возвращает (map для ffmpeg, уверен ли выбор):
+    выбор не уверенный, если дорожек несколько, а подходящей нет."""
+    try:
+        proc = subprocess.run(
+            [
+                "ffprobe", "-v", "error", "-select_streams", "a",
+                "-show_entries", "stream=index:stream_tags=language,title", "-of", "json", full_path
+            ],
+            capture_output=True, text=True, timeout=30
+        )
+        streams = json.loads(proc.stdout or "{}").get("streams", [])
+    except (subprocess.TimeoutExpired, FileNotFoundError, ValueError):
+        return "0:a:0", False
+    pattern = re.compile(AUDIO_LANG_FILTER, re.IGNORECASE)
+    for stream in streams:
+        tags = stream.get("tags", {})
+        if pattern.search(f"{tags.get('language', '')},{tags.get('title', '')}"):
+            return f"0:{stream['index']}", True
+    return "0:a:0", len(streams) == 1
+
+
+def build_ffmpeg_args(full_path, video_codec, audio_map="0:a:0"):
+    """Фрагментированный MP4 в stdout: видео копируется, если браузер его умеет,
+    аудио — выбранная дорожка в AAC stereo (как в convert.sh)."""
+    if video_codec in SUPPORTED_VIDEO_CODECS:
+        video_opts = ["-c:v", "copy"]
+        if video_codec == "hevc":
+            video_opts += ["-tag:v", "hvc1"]
+    else:
+        video_opts = ["-c:v", "libx264", "-preset", "veryfast", "-crf", "23"]
+    return [
+        "ffmpeg", "-nostdin", "-v", "error", "-i", full_path,
+        "-map", "0:v:0", "-map", audio_map,
+        *video_opts,
+        "-c:a", "aac", "-ac", "2", "-b:a", "192k",
+        "-movflags", "frag_keyframe+empty_moov+default_base_moof",
+        "-f", "mp4", "pipe:1",
+    ]
+
+
+def _keep_converted(full_path, rel_path, part_path):
+    """Подменяет исходник готовым результатом и перепроверяет его."""
+    os.replace(part_path, full_path)
+    invalidate(rel_path)
+    check = validate_video(full_path)
+    conn = get_db()
+    save_check(conn, rel_path, check)
+    conn.commit()
+    conn.close()
+    print(f"[LIVE] Kept converted file: {rel_path} ({'OK' if check['ok'] else 'ERR'})", flush=True)
+
+
+async def _pipe_ffmpeg(proc, stream, full_path, rel_path, keep):
+    part_path = full_path + ".live.part"
+    part = open(part_path, "wb") if keep else None
+    completed = False
+    try:
+        while not stream.cancelled:
+            chunk = await proc.stdout.read(STREAM_CHUNK_SIZE)
+            if not chunk:
+                completed = await proc.wait() == 0
+                break
+            await stream.throttle(len(chunk))
+            if part:
+                await asyncio.to_thread(part.write, chunk)
+            stream.record(len(chunk))
+            yield chunk
+    finally:
+        if proc.returncode is None:
+            proc.kill()
+            await proc.wait()
+        active_transcodes.pop(stream.id, None)
+        close_stream(stream)
+        if part:
+            part.close()
+            if completed:
+                await asyncio.to_thread(_keep_converted, full_path, rel_path, part_path)
+            elif os.path.exists(part_path):
+                os.remove(part_path)
+
+
+def _prune_orphans():
+    """Гасит ffmpeg у раздач, которые планировщик уже закрыл, а тело ответа
+    так и не начало читаться (клиент ушёл сразу)."""
+    for stream_id, (rel_path, proc) in list(active_transcodes.items()):
+        if stream_id not in active_streams:
+            if proc.returncode is None:
+                proc.kill()
+            active_transcodes.pop(stream_id, None)
+
+
+async def live_remux_response(full_path, rel_path, username):
+    """Раздаёт файл через ffmpeg на лету. Перемотка вперёд не поддерживается."""
+    _prune_orphans()
+    if len(active_transcodes) >= LIVE_TRANSCODE_MAX:
+        raise HTTPException(status_code=503, detail="Transcoder busy")
+    audio_map, audio_certain = await asyncio.to_thread(pick_audio_stream, full_path)
+    # Результат сохраняем, только если этот файл сейчас не пишет другая раздача и выбор
+    # дорожки однозначен: в нём остаётся одна дорожка, остальные пропадут вместе с исходником
+    writing = {p for p, _ in active_transcodes.values()}
+    keep = LIVE_TRANSCODE_KEEP and audio_certain and rel_path not in writing
+    # Раздачу регистрируем до запуска ffmpeg: при отказе по лимиту процесс не нужен
+    stream = open_stream(username, rel_path)
+    try:
+        proc = await asyncio.create_subprocess_exec(
+            *build_ffmpeg_args(full_path, get_video_codec(rel_path), audio_map),
+            stdout=asyncio.subprocess.PIPE,
+            stderr=asyncio.subprocess.DEVNULL,
+        )
+    except OSError:
+        close_stream(stream)
+        raise HTTPException(status_code=503, detail="Transcoder unavailable")
+    active_transcodes[stream.id] = (rel_path, proc)
+    return StreamingResponse(
+        _pipe_ffmpeg(proc, stream, full_path, rel_path, keep),
+        media_type="video/mp4",
+        headers={"Accept-Ranges": "none"},
+    )
+
+
+def get_transcode_stats():
+    _prune_orphans()
+    return {
+        "active": len(active_transcodes),
+        "max": LIVE_TRANSCODE_MAX,
+        "files": sorted(p for p, _ in active_transcodes.values()),
+    }
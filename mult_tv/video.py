@@ -1,22 +1,80 @@
 import os
 import json
 import random
+import struct
 import subprocess
+from datetime import datetime
+from concurrent.futures import ThreadPoolExecutor
 from fastapi import HTTPException
-from config import VIDEO_DIR, COMPLETE_DIR
+from config import (
+    VIDEO_DIR, VIDEO_DIRS, DEEP_CHECK_SAMPLES, DEEP_CHECK_WINDOW_SECONDS, DEEP_CHECK_WORKERS,
+    DEEP_CHECK_TOLERATED_ERRORS
+)
+
+# Кодеки, которые браузер играет в MP4 без перекодирования
+SUPPORTED_VIDEO_CODECS = ("h264", "hevc", "vp9", "av1")
+SUPPORTED_AUDIO_CODECS = ("aac", "mp3", "opus", "vorbis", "flac")
+
+# Общий пул декодирования: ограничивает число одновременных ffmpeg по всем файлам
+_decode_pool = ThreadPoolExecutor(max_workers=DEEP_CHECK_WORKERS)
+
+# Растёт при каждом изменении каталога (проверка, удаление, перепаковка файла)
+_library_version = 0
+
+
+def mark_library_changed():
+    global _library_version
+    _library_version += 1
+
+
+def library_version():
+    return _library_version
 
 
 def safe_path(base_dir: str, user_path: str):
+    base = os.path.realpath(base_dir)
     full = os.path.realpath(os.path.join(base_dir, user_path))
-    if not full.startswith(os.path.realpath(base_dir)):
+    if full != base and not full.startswith(base + os.sep):
         raise HTTPException(status_code=403, detail="Access denied")
     return full
 
 
+def resolve_video_path(user_path: str):
+    """Ищет относительный путь во всех корнях библиотеки по порядку.
+    Если файла нет нигде, возвращает путь в основном корне."""
+    for root in VIDEO_DIRS:
+        full = safe_path(root, user_path)
+        if os.path.exists(full):
+            return full
+    return safe_path(VIDEO_DIR, user_path)
+
+
+# Корни библиотеки как в конфиге и их realpath, длинные первыми. Считаются один раз:
+# video_root вызывается для каждого файла в каждом проходе по библиотеке
+_ROOT_BASES = sorted(
+    {base for root in VIDEO_DIRS for base in (root.rstrip(os.sep), os.path.realpath(root))},
+    key=len, reverse=True
+)
+
+
+def video_root(file_path):
+    """Корень библиотеки, в котором лежит файл (самый длинный подходящий).
+    Учитывает и путь корня как в конфиге, и его realpath."""
+    for base in _ROOT_BASES:
+        if file_path == base or file_path.startswith(base + os.sep):
+            return base
+    return VIDEO_DIR
+
+
+def rel_video_path(file_path):
+    """Стабильный ID файла: путь относительно его корня библиотеки."""
+    return os.path.relpath(file_path, video_root(file_path))
+
+
 def get_show_name(file_path):
-    """Возвращает имя папки-сериала относительно VIDEO_DIR.
+    """Возвращает имя папки-сериала относительно корня библиотеки.
     Пропускает промежуточные папки complete/incomplete."""
-    rel = os.path.relpath(file_path, VIDEO_DIR)
+    rel = rel_video_path(file_path)
     parts = rel.split(os.sep)
     if len(parts) > 2 and parts[0] in ('complete', 'incomplete'):
         return parts[1]
@@ -24,61 +82,247 @@ def get_show_name(file_path):
 
 
 def get_blocked_files():
-    """Возвращает set файлов, не прошедших проверку."""
+    """Возвращает set файлов, не прошедших проверку (в том числе глубокую)."""
     from db import get_db
     conn = get_db()
-    rows = conn.execute('SELECT file_path FROM video_checks WHERE ok = 0').fetchall()
+    rows = conn.execute(
+        'SELECT file_path FROM video_checks WHERE ok = 0 '
+        'UNION SELECT file_path FROM video_checks WHERE deep_ok = 0 AND deep_fingerprint = fingerprint'
+    ).fetchall()
     conn.close()
     return {row[0] for row in rows}
 
 
-def get_all_videos():
-    """Собирает все mp4-файлы из VIDEO_DIR, исключая заблокированные."""
-    blocked = get_blocked_files()
+def _scan_root(root):
     files = []
-    for root, dirs, filenames in os.walk(VIDEO_DIR):
+    for dirpath, dirs, filenames in os.walk(root):
         for f in filenames:
             if f.lower().endswith('.mp4'):
-                full_path = os.path.join(root, f)
-                rel_path = os.path.relpath(full_path, VIDEO_DIR)
-                if rel_path not in blocked:
-                    files.append(full_path)
+                files.append(os.path.join(dirpath, f))
     return files
 
 
-def get_all_videos_unfiltered():
-    """Собирает все mp4-файлы из VIDEO_DIR без фильтрации."""
-    files = []
-    for root, dirs, filenames in os.walk(VIDEO_DIR):
-        for f in filenames:
-            if f.lower().endswith('.mp4'):
-                files.append(os.path.join(root, f))
+def scan_videos():
+    """Параллельно обходит все корни (по потоку на диск).
+    Возвращает {rel_path: full_path}; при совпадении путей побеждает корень, указанный раньше."""
+    with ThreadPoolExecutor(max_workers=len(VIDEO_DIRS)) as pool:
+        per_root = list(pool.map(_scan_root, VIDEO_DIRS))
+    files = {}
+    for root, root_files in zip(VIDEO_DIRS, per_root):
+        for full_path in root_files:
+            files.setdefault(os.path.relpath(full_path, root), full_path)
     return files
 
 
+def get_live_files():
+    """Заблокированные файлы, которые можно показать через живой ремукс:
+    потоки и длительность есть, не подходят только кодеки."""
+    from db import get_db
+    conn = get_db()
+    rows = conn.execute(
+        "SELECT file_path FROM video_checks "
+        "WHERE ok = 0 AND video_codec != '' AND audio_codec != '' AND duration > 0 "
+        "AND NOT (deep_ok = 0 AND deep_fingerprint = fingerprint)"
+    ).fetchall()
+    conn.close()
+    return {row[0] for row in rows}
+
+
+def get_known_duration(rel_path):
+    """Длительность по ffprobe из video_checks или None. Нужна плееру для /live,
+    где фрагментированный MP4 не сообщает длительность."""
+    from db import get_db
+    conn = get_db()
+    row = conn.execute('SELECT duration FROM video_checks WHERE file_path = ?', (rel_path,)).fetchone()
+    conn.close()
+    return row[0] if row and row[0] else None
+
+
+def get_all_videos():
+    """Собирает все mp4-файлы из всех корней, исключая заблокированные
+    (кроме тех, что можно показать через живой ремукс)."""
+    blocked = get_blocked_files() - get_live_files()
+    return [full for rel, full in scan_videos().items() if rel not in blocked]
+
+
+def get_all_videos_unfiltered():
+    """Собирает все mp4-файлы из всех корней без фильтрации."""
+    return list(scan_videos().values())
+
+
 def get_sorted_shows():
-    """Возвращает отсортированный список папок-сериалов из complete/."""
-    if not os.path.isdir(COMPLETE_DIR):
-        return []
-    return sorted([
-        d for d in os.listdir(COMPLETE_DIR)
-        if os.path.isdir(os.path.join(COMPLETE_DIR, d)) and not d.startswith('.')
-    ])
-
-
-def pick_from_show(show_name, all_files, recently_watched):
-    """Выбирает случайную непросмотренную серию из указанного сериала."""
-    show_files = [f for f in all_files if get_show_name(f) == show_name]
-    if not show_files:
+    """Возвращает отсортированный список папок-сериалов из complete/ всех корней."""
+    shows = set()
+    for root in VIDEO_DIRS:
+        complete_dir = os.path.join(root, "complete")
+        if not os.path.isdir(complete_dir):
+            continue
+        shows.update(
+            d for d in os.listdir(complete_dir)
+            if os.path.isdir(os.path.join(complete_dir, d)) and not d.startswith('.')
+        )
+    return sorted(shows)
+
+
+def get_next_show(current_show, shows=None):
+    """Следующий сериал по кругу (для кнопки СЛЕД)."""
+    shows = shows if shows is not None else get_sorted_shows()
+    if not shows:
         return None
-    available = [f for f in show_files if f not in recently_watched]
+    try:
+        idx = shows.index(current_show)
+        return shows[(idx + 1) % len(shows)]
+    except ValueError:
+        return shows[0]
+
+
+def group_by_show(files):
+    """{сериал: [файлы]} за один проход — выбор серии и прогрев берут списки отсюда."""
+    by_show = {}
+    for f in files:
+        by_show.setdefault(get_show_name(f), []).append(f)
+    return by_show
+
+
+def get_show_candidates(show_files, recently_watched):
+    """Серии сериала, из которых идёт выбор: непросмотренные, а если таких нет — все."""
+    available = [f for f in show_files if rel_video_path(f) not in recently_watched]
+    return available or show_files
+
+
+def pick_from_show(show_name, by_show, recently_watched, prefer=None):
+    """Выбирает случайную непросмотренную серию из указанного сериала (by_show — из group_by_show).
+    Если часть кандидатов есть в prefer (уже в горячем кэше) — выбирает среди них."""
+    available = get_show_candidates(by_show.get(show_name, []), recently_watched)
     if not available:
-        available = show_files
+        return None
+    if prefer:
+        preferred = [f for f in available if rel_video_path(f) in prefer]
+        if preferred:
+            return random.choice(preferred)
     return random.choice(available)
 
 
-def validate_video(file_path):
-    """Проверяет видеофайл через ffprobe. Возвращает dict с результатом."""
+def file_fingerprint(file_path):
+    """Отпечаток содержимого без чтения файла: размер и mtime."""
+    st = os.stat(file_path)
+    return f"{st.st_size}:{st.st_mtime_ns}"
+
+
+def probe_mp4_layout(file_path):
+    """Читает заголовки боксов верхнего уровня MP4 без ffmpeg.
+    Возвращает 1 если moov перед mdat (faststart), 0 если после, None если не понять."""
+    try:
+        file_size = os.path.getsize(file_path)
+        with open(file_path, "rb") as f:
+            offset = 0
+            while offset + 8 <= file_size:
+                f.seek(offset)
+                header = f.read(8)
+                if len(header) < 8:
+                    return None
+                size, box_type = struct.unpack(">I4s", header)
+                if size == 1:
+                    large = f.read(8)
+                    if len(large) < 8:
+                        return None
+                    size = struct.unpack(">Q", large)[0]
+                elif size == 0:
+                    size = file_size - offset
+                if box_type == b"moov":
+                    return 1
+                if box_type == b"mdat":
+                    return 0
+                if size < 8:
+                    return None
+                offset += size
+    except OSError:
+        return None
+    return None
+
+
+def save_check(conn, rel_path, check):
+    """Записывает результат validate_video в video_checks (без commit).
+    Результат глубокой проверки пишется, только если она запускалась."""
+    conn.execute(
+        'INSERT INTO video_checks '
+        '(file_path, ok, errors, video_codec, audio_codec, duration, size_mb, fingerprint, faststart, checked_at) '
+        'VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?) '
+        'ON CONFLICT(file_path) DO UPDATE SET '
+        'ok = excluded.ok, errors = excluded.errors, video_codec = excluded.video_codec, '
+        'audio_codec = excluded.audio_codec, duration = excluded.duration, size_mb = excluded.size_mb, '
+        'fingerprint = excluded.fingerprint, faststart = excluded.faststart, checked_at = excluded.checked_at',
+        (
+            rel_path,
+            1 if check["ok"] else 0,
+            "; ".join(check["errors"]),
+            check["video_codec"],
+            check["audio_codec"],
+            check["duration"],
+            check["size_mb"],
+            check["fingerprint"],
+            check["faststart"],
+            datetime.now(),
+        )
+    )
+    if check.get("deep_ok") is not None:
+        conn.execute(
+            'UPDATE video_checks SET deep_ok = ?, deep_errors = ?, deep_fingerprint = ?, deep_checked_at = ? '
+            'WHERE file_path = ?',
+            (
+                1 if check["deep_ok"] else 0,
+                "; ".join(check["deep_errors"]),
+                check["fingerprint"],
+                datetime.now(),
+                rel_path,
+            )
+        )
+    mark_library_changed()
+
+
+def _decode_window(file_path, start):
+    """Декодирует DEEP_CHECK_WINDOW_SECONDS секунд с ближайшего ключевого кадра в null.
+    Возвращает текст ошибки или None. Поломка — ненулевой код ffmpeg или ошибки,
+    которые продолжаются дольше шума первой GOP после перемотки."""
+    try:
+        proc = subprocess.run(
+            [
+                "ffmpeg", "-nostdin", "-v", "error", "-threads", "1",
+                "-ss", f"{start:.1f}", "-i", file_path,
+                "-t", str(DEEP_CHECK_WINDOW_SECONDS), "-f", "null", "-"
+            ],
+            capture_output=True, text=True, timeout=60
+        )
+    except subprocess.TimeoutExpired:
+        return f"{start:.0f}с: таймаут декодирования"
+    except FileNotFoundError:
+        return "ffmpeg не установлен"
+    lines = proc.stderr.strip().splitlines()
+    if proc.returncode != 0 or len(lines) > DEEP_CHECK_TOLERATED_ERRORS:
+        # Первые строки — обычно тот самый шум после перемотки, показываем последнюю
+        message = lines[-1][:120] if lines else "ffmpeg error"
+        return f"{start:.0f}с: {message}"
+    return None
+
+
+def deep_check_video(file_path, duration):
+    """Декодирует окна в DEEP_CHECK_SAMPLES равномерно распределённых точках
+    параллельно в общем пуле. Последнее окно упирается в конец файла — ловит обрезанные торренты."""
+    if duration <= 0:
+        return {"deep_ok": False, "deep_errors": ["Нет длительности для глубокой проверки"]}
+    window = min(DEEP_CHECK_WINDOW_SECONDS, duration)
+    starts = [
+        (duration - window) * i / max(DEEP_CHECK_SAMPLES - 1, 1)
+        for i in range(DEEP_CHECK_SAMPLES)
+    ]
+    futures = [_decode_pool.submit(_decode_window, file_path, start) for start in starts]
+    errors = list(dict.fromkeys(e for e in (f.result() for f in futures) if e))
+    return {"deep_ok": not errors, "deep_errors": errors}
+
+
+def validate_video(file_path, deep=False):
+    """Проверяет видеофайл через ffprobe. Возвращает dict с результатом.
+    С deep=True дополнительно декодирует фрагменты файла (deep_ok/deep_errors)."""
     result = {
         "ok": True,
         "errors": [],
@@ -86,11 +330,14 @@ def validate_video(file_path):
         "audio_codec": "",
         "duration": 0,
         "size_mb": 0,
+        "faststart": None,
+        "fingerprint": "",
     }
 
     # Проверка размера
     try:
         size = os.path.getsize(file_path)
+        result["fingerprint"] = file_fingerprint(file_path)
         result["size_mb"] = round(size / (1024 * 1024), 1)
         if size == 0:
             result["ok"] = False
@@ -101,6 +348,9 @@ def validate_video(file_path):
         result["errors"].append("Файл не найден или недоступен")
         return result
 
+    # Где лежит moov: без faststart браузер лезет за ним в конец файла
+    result["faststart"] = probe_mp4_layout(file_path)
+
     # Запуск ffprobe
     try:
         proc = subprocess.run(
@@ -144,7 +394,7 @@ def validate_video(file_path):
     else:
         vcodec = video_streams[0].get("codec_name", "unknown")
         result["video_codec"] = vcodec
-        if vcodec not in ("h264", "hevc", "vp9", "av1"):
+        if vcodec not in SUPPORTED_VIDEO_CODECS:
             result["ok"] = False
             result["errors"].append(f"Неподдерживаемый видеокодек: {vcodec}")
 
@@ -156,7 +406,7 @@ def validate_video(file_path):
     else:
         acodec = audio_streams[0].get("codec_name", "unknown")
         result["audio_codec"] = acodec
-        if acodec not in ("aac", "mp3", "opus", "vorbis", "flac"):
+        if acodec not in SUPPORTED_AUDIO_CODECS:
             result["ok"] = False
             result["errors"].append(f"Неподдерживаемый аудиокодек: {acodec}")
 
@@ -171,4 +421,7 @@ def validate_video(file_path):
         result["ok"] = False
         result["errors"].append("Не удалось определить длительность")
 
+    if deep and result["video_codec"]:
+        result.update(deep_check_video(file_path, result["duration"]))
+
     return result